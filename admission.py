@@ -0,0 +1,236 @@
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# 기본 비용 계수 (RTX 4090, FastVideo LoRA 기준 대략값 - 실제 작업 시간으로 보정됨)
+DEFAULT_OVERHEAD_S = 10.0
+DEFAULT_SAMPLING_S_PER_UNIT = 3.5e-7   # 초 / (pixel * frame * step)
+DEFAULT_DECODE_S_PER_UNIT = 2.0e-7     # 초 / (pixel * frame)
+DEFAULT_UPSCALE_S_PER_UNIT = 2.0e-6    # 초 / (pixel * frame), 4x 모델 업스케일
+
+
+class CostModel:
+    """
+    Estimates GPU-seconds for a video job.
+
+    cost = overhead + sampling * pixels * frames * steps
+                    + decode * pixels * frames
+                    + upscale * pixels * frames   (only when upscaling)
+
+    The prior coefficients are scaled by a calibration factor that tracks the
+    ratio of observed to predicted job time (EWMA), so estimates converge on
+    the actual hardware after a few jobs.
+    """
+
+    def __init__(self, overhead_s: float = DEFAULT_OVERHEAD_S,
+                 sampling_s_per_unit: float = DEFAULT_SAMPLING_S_PER_UNIT,
+                 decode_s_per_unit: float = DEFAULT_DECODE_S_PER_UNIT,
+                 upscale_s_per_unit: float = DEFAULT_UPSCALE_S_PER_UNIT,
+                 smoothing: float = 0.2):
+        self.overhead_s = overhead_s
+        self.sampling_s_per_unit = sampling_s_per_unit
+        self.decode_s_per_unit = decode_s_per_unit
+        self.upscale_s_per_unit = upscale_s_per_unit
+        self.smoothing = smoothing
+        self.calibration = 1.0
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def _raw_estimate(self, width: int, height: int, frame_length: int, steps: int,
+                      enable_upscale: bool) -> float:
+        pixel_frames = width * height * frame_length
+        cost = self.overhead_s
+        cost += self.sampling_s_per_unit * pixel_frames * steps
+        cost += self.decode_s_per_unit * pixel_frames
+        if enable_upscale:
+            cost += self.upscale_s_per_unit * pixel_frames
+        return cost
+
+    def estimate(self, width: int, height: int, frame_length: int, steps: int,
+                 enable_upscale: bool = False) -> float:
+        with self._lock:
+            calibration = self.calibration
+        return self._raw_estimate(width, height, frame_length, steps, enable_upscale) * calibration
+
+    def observe(self, width: int, height: int, frame_length: int, steps: int,
+                enable_upscale: bool, actual_s: float):
+        """Update the calibration factor with an observed job duration"""
+        predicted = self._raw_estimate(width, height, frame_length, steps, enable_upscale)
+        if predicted <= 0 or actual_s <= 0:
+            return
+        ratio = actual_s / predicted
+        with self._lock:
+            if self.samples == 0:
+                self.calibration = ratio
+            else:
+                self.calibration += self.smoothing * (ratio - self.calibration)
+            self.samples += 1
+
+
+class AdmissionDecision:
+    ADMITTED = "admitted"
+    DEFERRED = "deferred"
+    REJECTED = "rejected"
+
+    def __init__(self, status: str, estimate_s: float, eta_s: float, reason: Optional[str] = None,
+                 retry_after_s: Optional[float] = None):
+        self.status = status
+        self.estimate_s = estimate_s
+        self.eta_s = eta_s
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+    @property
+    def admitted(self) -> bool:
+        return self.status == self.ADMITTED
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            'status': self.status,
+            'estimated_gpu_seconds': round(self.estimate_s, 1),
+            'eta_seconds': round(self.eta_s, 1)
+        }
+        if self.reason:
+            result['reason'] = self.reason
+        if self.retry_after_s is not None:
+            result['retry_after_seconds'] = round(self.retry_after_s, 1)
+        return result
+
+
+class AdmissionController:
+    """
+    Tracks outstanding GPU work and admits, defers or rejects new jobs.
+
+    - A job whose own estimate exceeds max_job_s is rejected outright. Jobs split
+      over several backends (parallelism > 1) are judged on their wall-clock share.
+    - A job whose estimate alone is larger than the user's or the global budget
+      can never fit and is rejected as well.
+    - A job that would push a user's or the global outstanding GPU-seconds
+      over budget is deferred: the caller gets a retry-after hint based on
+      when enough of the current work should have drained.
+      Jobs without a user id only count against the global budget.
+    """
+
+    def __init__(self, cost_model: Optional[CostModel] = None, max_job_s: float = 900.0,
+                 per_user_budget_s: float = 1200.0, global_budget_s: float = 3600.0,
+                 concurrency: int = 1):
+        self.cost_model = cost_model or CostModel()
+        self.max_job_s = max_job_s
+        self.per_user_budget_s = per_user_budget_s
+        self.global_budget_s = global_budget_s
+        self.concurrency = max(concurrency, 1)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _remaining_s(self, job: Dict[str, Any], now: float) -> float:
+        if job['started_at'] is None:
+            return job['estimate_s']
+        return max(job['estimate_s'] - (now - job['started_at']) * job['parallelism'], 0.0)
+
+    def _outstanding_s(self, now: float, user_id: Optional[str] = None) -> float:
+        return sum(
+            self._remaining_s(job, now)
+            for job in self._jobs.values()
+            if user_id is None or job['user_id'] == user_id
+        )
+
+    def queue_eta_s(self) -> float:
+        """Seconds until a newly submitted job would start, given current load"""
+        with self._lock:
+            return self._outstanding_s(time.time()) / self.concurrency
+
+    def estimate(self, params: Dict[str, Any], steps: int) -> AdmissionDecision:
+        """Cost and ETA for a job without reserving any budget"""
+        estimate = self._estimate(params, steps)
+        return AdmissionDecision(AdmissionDecision.ADMITTED, estimate, self.queue_eta_s() + estimate)
+
+    def _estimate(self, params: Dict[str, Any], steps: int) -> float:
+        return self.cost_model.estimate(params['width'], params['height'], params['frame_length'],
+                                        steps, params['enable_upscale'])
+
+    def admit(self, job_id: str, user_id: Optional[str], params: Dict[str, Any], steps: int,
+              parallelism: int = 1, max_job_s: Optional[float] = None,
+              per_user_budget_s: Optional[float] = None) -> AdmissionDecision:
+        """
+        parallelism: how many backends render parts of this job at the same time
+        max_job_s, per_user_budget_s: limits for this kind of job (default to the controller's)
+        """
+        estimate = self._estimate(params, steps)
+        # 예산은 전체 GPU 시간으로 잡고, 작업 한도와 ETA 는 실제 걸리는 시간 기준
+        wall_s = estimate / max(parallelism, 1)
+        max_job_s = self.max_job_s if max_job_s is None else max_job_s
+        per_user_budget_s = self.per_user_budget_s if per_user_budget_s is None else per_user_budget_s
+        with self._lock:
+            now = time.time()
+            global_outstanding = self._outstanding_s(now)
+            eta = global_outstanding / self.concurrency + wall_s
+
+            if wall_s > max_job_s:
+                return AdmissionDecision(
+                    AdmissionDecision.REJECTED, estimate, eta,
+                    reason=f"Estimated {wall_s:.0f} seconds exceeds the per-job limit of {max_job_s:.0f}"
+                )
+
+            # 예산보다 큰 작업은 다시 시도해도 들어갈 수 없으므로 보류(429) 대신 거절
+            if user_id is not None and estimate > per_user_budget_s:
+                return AdmissionDecision(
+                    AdmissionDecision.REJECTED, estimate, eta,
+                    reason=f"Estimated {estimate:.0f} GPU seconds exceeds the per-user budget of {per_user_budget_s:.0f}"
+                )
+            if estimate > self.global_budget_s:
+                return AdmissionDecision(
+                    AdmissionDecision.REJECTED, estimate, eta,
+                    reason=f"Estimated {estimate:.0f} GPU seconds exceeds the server budget of {self.global_budget_s:.0f}"
+                )
+
+            # userId 가 없는 요청을 한 사용자로 묶으면 사용자 예산이 더 낮은 전역 상한이 되므로 건너뜀
+            if user_id is not None:
+                user_outstanding = self._outstanding_s(now, user_id)
+                if user_outstanding + estimate > per_user_budget_s:
+                    return AdmissionDecision(
+                        AdmissionDecision.DEFERRED, estimate, eta,
+                        reason="Per-user GPU budget exceeded",
+                        retry_after_s=user_outstanding + estimate - per_user_budget_s
+                    )
+
+            if global_outstanding + estimate > self.global_budget_s:
+                return AdmissionDecision(
+                    AdmissionDecision.DEFERRED, estimate, eta,
+                    reason="Server GPU budget exceeded",
+                    retry_after_s=(global_outstanding + estimate - self.global_budget_s) / self.concurrency
+                )
+
+            self._jobs[job_id] = {
+                'user_id': user_id,
+                'params': params,
+                'steps': steps,
+                'estimate_s': estimate,
+                'parallelism': max(parallelism, 1),
+                'admitted_at': now,
+                'started_at': None
+            }
+            return AdmissionDecision(AdmissionDecision.ADMITTED, estimate, eta)
+
+    def mark_started(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job['started_at'] is None:
+                job['started_at'] = time.time()
+
+    def on_trace_event(self, job_id: str, event: Dict[str, Any]):
+        """Tracer listener: the end of the queue_wait span is when the GPU picks the job up"""
+        if event.get('name') == 'queue_wait':
+            self.mark_started(job_id)
+
+    def release(self, job_id: str, succeeded: bool = False):
+        """
+        Free the job's share of the budget.
+        For successful jobs the observed start-to-finish time is fed back to the cost model.
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None or not succeeded or job['started_at'] is None:
+            return
+        params = job['params']
+        self.cost_model.observe(params['width'], params['height'], params['frame_length'],
+                                job['steps'], params['enable_upscale'], time.time() - job['started_at'])
\ No newline at end of file
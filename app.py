@@ -1,10 +1,21 @@
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, Response, request, jsonify, send_file, render_template
 from hunyuan_client import HunyuanVideoClient
 from flux_s_client import FluxImageClient
-from config import load_config
+from config import load_config, load_backends
 from prompt_generator import PromptGenerator
+from tracing import tracer
+from admission import AdmissionController, AdmissionDecision
+from cancellation import CancelRegistry, JobCancelled, DEADLINE_EXCEEDED, cancel_on_close
+from job_store import JobStore, STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED
+from recovery import JobRecovery
+from mp4_faststart import Mp4PostProcessor
+from retention import RetentionManager
+from long_video import LongVideoRenderer, transition_frames
+from workflow_schema import schema_cache, WorkflowValidationError
 from datetime import datetime
+import asyncio
 import random
+import uuid
 import os
 import time
 import json
@@ -13,9 +24,41 @@ app = Flask(__name__)
 video_client = HunyuanVideoClient()
 image_client = FluxImageClient()
 prompt_generator = PromptGenerator()
+admission = AdmissionController()
+tracer.add_listener(admission.on_trace_event)
+cancellations = CancelRegistry()
+job_store = JobStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db'))
+# 완성된 비디오를 백그라운드에서 fast-start MP4 로 재배치 (fragmented=True 면 moof 조각으로)
+mp4_postprocessor = Mp4PostProcessor(fragmented=False)
 
 OUTPUT_DIR = r"D:\ComfyUI_windows_portable\ComfyUI\output"
 
+# 출력 폴더 용량 관리: 기본은 보고만 하고, 설정 파일에 RETENTION_DELETE=true 가 있을 때만 실제로 삭제
+RETENTION_DRY_RUN = load_config().get('RETENTION_DELETE', 'false').lower() != 'true'
+RETENTION_SWEEP_INTERVAL_S = 600
+retention = RetentionManager(OUTPUT_DIR, job_store, dry_run=RETENTION_DRY_RUN)
+
+# HunyuanVideo 입력 제한 (해상도는 16의 배수, 프레임 수는 4k+1)
+MIN_VIDEO_SIDE = 256
+MAX_VIDEO_SIDE = 1280
+MAX_FRAME_LENGTH = 129
+
+# 긴 영상은 구간으로 나눠 여러 ComfyUI 백엔드에서 동시에 렌더링 (30초 @ 24fps 까지)
+# 이웃한 구간은 몇 프레임씩 겹쳐 렌더링하고 겹친 부분을 크로스페이드로 이어붙임
+MAX_LONG_VIDEO_FRAMES = 721
+MIN_LONG_VIDEO_SEGMENT_FRAMES = 17
+LONG_VIDEO_OVERLAP_FRAMES = 8
+# 긴 영상의 작업 한도 (병렬 렌더 기준 예상 소요 시간)
+MAX_LONG_VIDEO_JOB_S = 3600
+# 긴 영상 한 편 (30초 1280x720) 은 일반 사용자 예산보다 크므로, 사용자당 긴 영상 하나를 돌릴 수 있는 예산
+LONG_VIDEO_USER_BUDGET_S = 3600
+long_video_renderer = LongVideoRenderer(load_backends(), OUTPUT_DIR, overlap_frames=LONG_VIDEO_OVERLAP_FRAMES,
+                                        min_segment_frames=MIN_LONG_VIDEO_SEGMENT_FRAMES)
+
+# 작업 마감 시간 (요청에 timeoutSeconds 가 없을 때)
+EXAMPLES_TIMEOUT_S = 300
+MIN_VIDEO_TIMEOUT_S = 300
+
 @app.route('/')
 def index():
     return render_template('prompt_gen.html')
@@ -64,63 +107,176 @@ def generate_prompt():
 
 @app.route('/generate_examples', methods=['POST'])
 def generate_examples():
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate_examples")
     data = request.json
-    prompt = data.get('prompt')
-    folder_name = data.get('savePath', 'flux_examples')
+    params, error = parse_examples_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    folder_name = params['folder_name']
     
-    if not prompt:
-        return jsonify({'error': 'Prompt is required'}), 400
+    timeout_s, error = parse_timeout(data, EXAMPLES_TIMEOUT_S)
+    if error:
+        return jsonify({'error': error}), 400
+    cancel_token = register_job(job_id, 'examples', data.get('userId'), params, params['seed'], timeout_s)
         
     try:
-        # ComfyUI 큐가 처리될 시간을 주기 위해 잠시 대기
-        time.sleep(1)
-        
-        # Generate 4 example images
-        image_paths = image_client.generate_images(
-            prompt=prompt,
-            folder_name=folder_name,
-            base_filename="example",
-            batch_size=4
-        )
-        
-        # 모든 이미지 파일이 완전히 생성될 때까지 대기
-        for path in image_paths:
-            while not os.path.exists(path):
-                time.sleep(0.5)
+        with tracer.span(job_id, "handle /generate_examples"):
+            # Generate 4 example images
+            # (generate_images 는 PNG 가 완전히 써진 뒤에 경로를 돌려주므로 추가 대기 불필요)
+            image_paths = image_client.generate_images(
+                base_filename="example",
+                job_id=job_id,
+                cancel_token=cancel_token,
+                **params
+            )
             
-            # 파일이 완전히 쓰여질 때까지 추가 대기
-            time.sleep(1)
-        
-        # Convert full paths to relative paths for frontend
-        relative_paths = [
-            os.path.join(folder_name, os.path.basename(path))
-            for path in image_paths
-        ]
-        
-        print(f"Generated image paths: {relative_paths}")
-        
-        return jsonify({
-            'success': True,
-            'image_paths': relative_paths
-        })
+            # Convert full paths to relative paths for frontend
+            relative_paths = [
+                os.path.join(folder_name, os.path.basename(path))
+                for path in image_paths
+            ]
+            
+            print(f"Generated image paths: {relative_paths}")
+            job_store.finish(job_id, STATUS_COMPLETED, relative_paths)
+            
+            with tracer.span(job_id, "build_response"):
+                return jsonify({
+                    'success': True,
+                    'job_id': job_id,
+                    'seed': params['seed'],
+                    'draft': params['draft'],
+                    'image_paths': relative_paths
+                })
+    except JobCancelled as e:
+        job_store.finish(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return jsonify(body), status
     except Exception as e:
         print(f"Error generating images: {str(e)}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/generate', methods=['POST'])
-def generate_video():
+        job_store.finish(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return jsonify(body), status
+    finally:
+        cancellations.remove(job_id)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/generate_examples/stream', methods=['POST'])
+def generate_examples_stream():
+    """
+    Same as /generate_examples, but streams each image as a Server-Sent Event
+    as soon as its file is written: job -> image x4 -> done (or error).
+    """
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate_examples/stream")
+    data = request.json
+    params, error = parse_examples_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    folder_name = params['folder_name']
+    
+    timeout_s, error = parse_timeout(data, EXAMPLES_TIMEOUT_S)
+    if error:
+        return jsonify({'error': error}), 400
+    cancel_token = register_job(job_id, 'examples', data.get('userId'), params, params['seed'], timeout_s)
+    
+    def events():
+        relative_paths = []
+        finished = False
+        images = image_client.iter_images(
+            base_filename="example",
+            job_id=job_id,
+            cancel_token=cancel_token,
+            **params
+        )
+        try:
+            yield sse_event('job', {'job_id': job_id, 'seed': params['seed'], 'draft': params['draft']})
+            for index, path in enumerate(images):
+                relative_path = os.path.join(folder_name, os.path.basename(path))
+                relative_paths.append(relative_path)
+                yield sse_event('image', {'index': index, 'path': relative_path})
+            
+            job_store.finish(job_id, STATUS_COMPLETED, relative_paths)
+            finished = True
+            yield sse_event('done', {'job_id': job_id, 'image_paths': relative_paths})
+        except JobCancelled as e:
+            job_store.finish(job_id, STATUS_CANCELLED, relative_paths, str(e))
+            finished = True
+            body, status = cancelled_error(e, cancel_token)
+            yield sse_event('error', dict(body, status=status))
+        except Exception as e:
+            print(f"Error generating images: {str(e)}")
+            job_store.finish(job_id, STATUS_FAILED, relative_paths, str(e))
+            finished = True
+            body, status = failed_error(e, job_id)
+            yield sse_event('error', dict(body, status=status))
+        finally:
+            images.close()
+            if not finished:
+                # 클라이언트 연결이 끊겨 스트림이 중간에 닫힌 경우
+                job_store.finish(job_id, STATUS_CANCELLED, relative_paths, 'client disconnected')
+            cancellations.remove(job_id)
+    
+    return Response(
+        cancel_on_close(events(), cancel_token),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/refine_example', methods=['POST'])
+def refine_example():
+    """Re-render one image of an example job at full resolution with the same seed"""
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/refine_example")
     data = request.json
+    params, error, status = parse_refine_request(data)
+    if error:
+        return jsonify({'error': error}), status
+    
+    timeout_s, error = parse_timeout(data, EXAMPLES_TIMEOUT_S)
+    if error:
+        return jsonify({'error': error}), 400
+    cancel_token = register_job(job_id, 'refine', data.get('userId'), params, params['seed'], timeout_s)
+    
+    try:
+        with tracer.span(job_id, "handle /refine_example"):
+            refined_path = image_client.refine_image(
+                image_path=os.path.join(image_client.base_output_dir, params['path']),
+                prompt=params['prompt'],
+                seed=params['seed'],
+                folder_name=params['folder_name'],
+                job_id=job_id,
+                cancel_token=cancel_token
+            )
+            relative_path = os.path.join(params['folder_name'], os.path.basename(refined_path))
+            job_store.finish(job_id, STATUS_COMPLETED, [relative_path])
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'seed': params['seed'],
+                'image_path': relative_path
+            })
+    except JobCancelled as e:
+        job_store.finish(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return jsonify(body), status
+    except Exception as e:
+        print(f"Error refining image: {str(e)}")
+        job_store.finish(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return jsonify(body), status
+    finally:
+        cancellations.remove(job_id)
+
+def parse_video_request(data):
+    """/generate 요청 데이터를 검증하고 (params, error) 튜플을 반환"""
     prompt = data.get('prompt')
     use_random_seed = data.get('useRandomSeed')
-    frame_length = data.get('frameLength', 73)
-    width = data.get('width', 848)
-    height = data.get('height', 480)
-    folder_name = data.get('savePath', 'KTaivle')
-    enable_upscale = data.get('enableUpscale', False)
-    seed = None
     
     if not prompt:
-        return jsonify({'error': 'Prompt is required'}), 400
+        return None, 'Prompt is required'
         
     if use_random_seed:
         seed = random.randint(1, 999999999999999)
@@ -128,42 +284,337 @@ def generate_video():
         try:
             seed = int(data.get('seed'))
             if not (1 <= seed <= 999999999999999):
-                return jsonify({'error': 'Seed must be between 1 and 999999999999999'}), 400
+                return None, 'Seed must be between 1 and 999999999999999'
         except (TypeError, ValueError):
-            return jsonify({'error': 'Invalid seed value'}), 400
+            return None, 'Invalid seed value'
     
     try:
-        # ComfyUI 큐가 처리될 시간을 주기 위해 잠시 대기
-        time.sleep(1)
-        
-        video_path = video_client.generate_video(
-            prompt=prompt,
-            folder_name=folder_name,
-            base_filename="video",
-            seed=seed,
-            frame_length=frame_length,
-            width=width,
-            height=height,
-            enable_upscale=enable_upscale
-        )
-        
-        # 비디오 생성이 완료될 때까지 대기
-        while not os.path.exists(video_path):
-            time.sleep(0.5)
+        frame_length = int(data.get('frameLength', 73))
+        width = int(data.get('width', 848))
+        height = int(data.get('height', 480))
+    except (TypeError, ValueError):
+        return None, 'frameLength, width and height must be integers'
+    
+    for name, value in (('width', width), ('height', height)):
+        if not (MIN_VIDEO_SIDE <= value <= MAX_VIDEO_SIDE) or value % 16 != 0:
+            return None, f'{name} must be a multiple of 16 between {MIN_VIDEO_SIDE} and {MAX_VIDEO_SIDE}'
+    
+    if not (1 <= frame_length <= MAX_FRAME_LENGTH) or (frame_length - 1) % 4 != 0:
+        return None, f'frameLength must be of the form 4k+1 and at most {MAX_FRAME_LENGTH}'
+    
+    enable_upscale = data.get('enableUpscale', False)
+    if not isinstance(enable_upscale, bool):
+        return None, 'enableUpscale must be a boolean'
+    
+    return {
+        'prompt': prompt,
+        'seed': seed,
+        'frame_length': frame_length,
+        'width': width,
+        'height': height,
+        'folder_name': data.get('savePath', 'KTaivle'),
+        'enable_upscale': enable_upscale
+    }, None
+
+def parse_long_video_request(data):
+    """/generate_long 요청 검증: segmentFrames 는 frameLength 규칙, totalFrames 는 전체 길이"""
+    params, error = parse_video_request(dict(data, frameLength=data.get('segmentFrames', 73)))
+    if error:
+        return None, error.replace('frameLength', 'segmentFrames')
+    
+    try:
+        total_frames = int(data.get('totalFrames'))
+    except (TypeError, ValueError):
+        return None, 'totalFrames must be an integer'
+    if not (1 <= total_frames <= MAX_LONG_VIDEO_FRAMES):
+        return None, f'totalFrames must be between 1 and {MAX_LONG_VIDEO_FRAMES}'
+    
+    segment_frames = params.pop('frame_length')
+    if segment_frames < MIN_LONG_VIDEO_SEGMENT_FRAMES:
+        return None, f'segmentFrames must be at least {MIN_LONG_VIDEO_SEGMENT_FRAMES}'
+    
+    params['segment_frames'] = segment_frames
+    params['total_frames'] = total_frames
+    return params, None
+
+def parse_examples_request(data):
+    """/generate_examples 요청 데이터를 검증하고 (params, error) 튜플을 반환"""
+    prompt = data.get('prompt')
+    if not prompt:
+        return None, 'Prompt is required'
+    
+    # refine 때 같은 seed 로 다시 그릴 수 있도록 seed 는 항상 앱에서 정해 기록
+    if data.get('seed') is None:
+        seed = random.randint(1, 999999999999999)
+    else:
+        try:
+            seed = int(data.get('seed'))
+            if not (1 <= seed <= 999999999999999):
+                return None, 'Seed must be between 1 and 999999999999999'
+        except (TypeError, ValueError):
+            return None, 'Invalid seed value'
+    
+    draft = data.get('draft', False)
+    if not isinstance(draft, bool):
+        return None, 'draft must be a boolean'
+    
+    return {
+        'prompt': prompt,
+        'seed': seed,
+        'folder_name': data.get('savePath', 'flux_examples'),
+        'batch_size': 4,
+        'draft': draft
+    }, None
+
+def parse_refine_request(data):
+    """/refine_example 요청에서 원본 예시 작업을 찾아 (params, error, status) 반환"""
+    job_id = data.get('jobId')
+    path = (data.get('path') or '').replace('\\', '/')
+    if not job_id or not path:
+        return None, 'jobId and path are required', 400
+    
+    job = job_store.get(job_id)
+    if job is None or job['kind'] != 'examples':
+        return None, 'Example job not found', 404
+    # 용량 정리로 지워진 이미지는 null 로 남아 있음
+    outputs = [output.replace('\\', '/') if output is not None else None for output in job['outputs']]
+    if path not in outputs:
+        return None, 'path is not an image of this job', 400
+    if job['seed'] is None:
+        return None, 'The seed of this job was not recorded', 409
+    
+    # 예시 이미지는 한 장씩 seed, seed+1, ... 로 렌더링됨 (outputs 는 같은 순서)
+    return {
+        'source_job_id': job_id,
+        'path': path,
+        'prompt': job['params']['prompt'],
+        'seed': job['seed'] + outputs.index(path),
+        'folder_name': job['params']['folder_name']
+    }, None, 200
+
+def register_job(job_id, kind, user_id, params, seed, timeout_s):
+    """작업을 저장소에 기록하고 취소 토큰을 발급 (ComfyUI 제출 시 prompt_id 도 기록)"""
+    job_store.create(job_id, kind, params, user_id, seed)
+    return cancellations.create(
+        job_id, timeout_s,
+        on_attach=lambda server_url, prompt_id: job_store.mark_running(job_id, server_url, prompt_id)
+    )
+
+def parse_timeout(data, default_s):
+    """요청의 timeoutSeconds 검증 (timeout, error) 반환"""
+    try:
+        timeout_s = float(data.get('timeoutSeconds', default_s))
+    except (TypeError, ValueError):
+        return None, 'timeoutSeconds must be a number'
+    if timeout_s <= 0:
+        return None, 'timeoutSeconds must be positive'
+    return timeout_s, None
+
+def cancelled_error(error, cancel_token):
+    """취소/마감 초과된 작업에 대한 응답 (body, status)"""
+    status = 504 if cancel_token.reason == DEADLINE_EXCEEDED else 409
+    return {'error': str(error), 'cancelled': True, 'job_id': cancel_token.job_id}, status
+
+def failed_error(error, job_id):
+    """실패한 작업에 대한 응답 (body, status); 제출 전 워크플로 검증 실패는 422"""
+    if isinstance(error, WorkflowValidationError):
+        return {'error': str(error), 'validation_errors': error.errors, 'job_id': job_id}, 422
+    return {'error': str(error), 'job_id': job_id}, 500
+
+def admission_error(decision):
+    """거절/보류된 작업에 대한 응답 (body, status, headers)"""
+    body = {'error': decision.reason, 'admission': decision.to_dict()}
+    if decision.status == AdmissionDecision.REJECTED:
+        return body, 422, {}
+    return body, 429, {'Retry-After': str(int(decision.retry_after_s) + 1)}
+
+@app.route('/estimate', methods=['POST'])
+def estimate_video():
+    params, error = parse_video_request(request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    decision = admission.estimate(params, video_client.STEPS)
+    return jsonify({'success': True, 'admission': decision.to_dict()})
+
+@app.route('/generate', methods=['POST'])
+def generate_video():
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate")
+    data = request.json
+    params, error = parse_video_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    seed = params['seed']
+    
+    decision = admission.admit(job_id, data.get('userId'), params, video_client.STEPS)
+    if not decision.admitted:
+        body, status, headers = admission_error(decision)
+        return jsonify(body), status, headers
+    
+    # 기본 마감 시간은 예상 대기+실행 시간의 두 배
+    timeout_s, error = parse_timeout(data, max(decision.eta_s * 2, MIN_VIDEO_TIMEOUT_S))
+    if error:
+        admission.release(job_id)
+        return jsonify({'error': error}), 400
+    cancel_token = register_job(job_id, 'video', data.get('userId'), params, seed, timeout_s)
+    
+    succeeded = False
+    try:
+        with tracer.span(job_id, "handle /generate", seed=seed):
+            # ComfyUI 큐가 처리될 시간을 주기 위해 잠시 대기
+            time.sleep(1)
             
-        # 파일이 완전히 쓰여질 때까지 추가 대기
-        time.sleep(2)
-        
-        filename = os.path.basename(video_path)
-        folder = os.path.basename(os.path.dirname(video_path))
-        return jsonify({
-            'success': True,
-            'seed': seed,
-            'filename': filename,
-            'folder': folder
-        })
+            video_path = video_client.generate_video(
+                base_filename="video",
+                job_id=job_id,
+                cancel_token=cancel_token,
+                **params
+            )
+            
+            # 비디오 생성이 완료될 때까지 대기
+            with tracer.span(job_id, "wait_file_complete"):
+                while not os.path.exists(video_path):
+                    cancel_token.check()
+                    time.sleep(0.5)
+                    
+                # 파일이 완전히 쓰여질 때까지 추가 대기
+                time.sleep(2)
+            succeeded = True
+            
+            filename = os.path.basename(video_path)
+            folder = os.path.basename(os.path.dirname(video_path))
+            job_store.finish(job_id, STATUS_COMPLETED, [f"{folder}/{filename}"])
+            mp4_postprocessor.submit(video_path, job_id)
+            with tracer.span(job_id, "build_response"):
+                return jsonify({
+                    'success': True,
+                    'job_id': job_id,
+                    'seed': seed,
+                    'filename': filename,
+                    'folder': folder,
+                    'admission': decision.to_dict()
+                })
+    except JobCancelled as e:
+        job_store.finish(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return jsonify(body), status
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        job_store.finish(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return jsonify(body), status
+    finally:
+        cancellations.remove(job_id)
+        admission.release(job_id, succeeded)
+
+@app.route('/generate_long', methods=['POST'])
+def generate_long_video():
+    """
+    Long video rendered as overlapping segments on every backend and joined with ffmpeg.
+    Each boundary is a cross-fade of overlap_frames starting at the frames listed in 'transitions'.
+    """
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate_long")
+    data = request.json
+    params, error = parse_long_video_request(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # 예산은 전체 GPU 작업량 (모든 구간의 프레임 합), 작업 한도는 백엔드 수로 나눈 소요 시간 기준
+    plan = long_video_renderer.plan(params['total_frames'], params['segment_frames'])
+    work = dict(params, frame_length=sum(segment['length'] for segment in plan))
+    decision = admission.admit(job_id, data.get('userId'), work, video_client.STEPS,
+                               parallelism=long_video_renderer.parallelism(plan),
+                               max_job_s=MAX_LONG_VIDEO_JOB_S,
+                               per_user_budget_s=LONG_VIDEO_USER_BUDGET_S)
+    if not decision.admitted:
+        body, status, headers = admission_error(decision)
+        return jsonify(body), status, headers
+    
+    timeout_s, error = parse_timeout(data, max(decision.eta_s * 2, MIN_VIDEO_TIMEOUT_S))
+    if error:
+        admission.release(job_id)
+        return jsonify({'error': error}), 400
+    cancel_token = register_job(job_id, 'long_video', data.get('userId'), params, params['seed'], timeout_s)
+    
+    try:
+        with tracer.span(job_id, "handle /generate_long", seed=params['seed'], segments=len(plan)):
+            video_path = asyncio.run(long_video_renderer.render(
+                job_id=job_id,
+                cancel_token=cancel_token,
+                **params
+            ))
+            filename = os.path.basename(video_path)
+            folder = os.path.basename(os.path.dirname(video_path))
+            job_store.finish(job_id, STATUS_COMPLETED, [f"{folder}/{filename}"])
+            mp4_postprocessor.submit(video_path, job_id)
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'seed': params['seed'],
+                'segments': len(plan),
+                'transitions': transition_frames(plan),
+                'overlap_frames': long_video_renderer.overlap_frames,
+                'filename': filename,
+                'folder': folder,
+                'admission': decision.to_dict()
+            })
+    except JobCancelled as e:
+        job_store.finish(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return jsonify(body), status
+    except Exception as e:
+        job_store.finish(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return jsonify(body), status
+    finally:
+        cancellations.remove(job_id)
+        # 병렬 렌더의 경과 시간은 GPU 시간이 아니므로 비용 모델 보정에 쓰지 않음
+        admission.release(job_id)
+
+# 워크플로 종류별 대표 워크플로 (백엔드가 어떤 종류를 실행할 수 있는지 확인용, 요청마다 만들지 않도록 한 번만 생성)
+SAMPLE_WORKFLOWS = {
+    'video': video_client._create_workflow('', 'check', seed=1),
+    'video_upscale': video_client._create_workflow('', 'check', seed=1, enable_upscale=True),
+    'examples': image_client._create_workflow('', 'check', seed=1),
+    'refine': image_client._create_refine_workflow('', 'check.png', 'check', seed=1),
+}
+
+@app.route('/backends')
+def backends_status():
+    """Schema cache state and, per workflow type, why a backend is excluded (if it is)"""
+    backends = []
+    for server_url in long_video_renderer.backends:
+        backends.append({
+            'server': server_url,
+            'workflows': {name: schema_cache.errors(server_url, workflow) for name, workflow in SAMPLE_WORKFLOWS.items()}
+        })
+    # 검사하면서 처음 받아온 스키마도 포함되도록 검사 후에 상태를 읽음
+    schemas = schema_cache.status()
+    for backend in backends:
+        backend['schema'] = schemas.get(backend['server'])
+    return jsonify({'backends': backends})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if not cancellations.cancel(job_id):
+        return jsonify({'error': 'Job not found or already finished'}), 404
+    # 렌더 스레드가 취소를 감지하기 전에 예산 슬롯을 바로 반환
+    admission.release(job_id)
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    if not tracer.has_trace(job_id):
+        return jsonify({'error': 'Trace not found'}), 404
+    # Chrome trace event 포맷 (Perfetto / chrome://tracing 에서 열람 가능)
+    return jsonify(tracer.export_chrome_trace(job_id))
 
 @app.route('/output/<path:filepath>')
 def serve_file(filepath):
@@ -180,6 +631,10 @@ def serve_file(filepath):
         # Determine the mimetype based on file extension
         mimetype = 'video/mp4' if filepath.endswith('.mp4') else 'image/png'
         
+        retention.touch(filepath)
+        if filepath.endswith('.mp4'):
+            # 렌더 직후 첫 재생이 fast-start 재배치 전 파일이나 교체 중인 파일을 받지 않도록 대기
+            mp4_postprocessor.wait(full_path)
         return send_file(
             full_path,
             mimetype=mimetype,
@@ -190,6 +645,42 @@ def serve_file(filepath):
         print(f"Error serving file: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pin_file', methods=['POST'])
+def pin_file():
+    data = request.json or {}
+    filepath = data.get('path')
+    if not filepath:
+        return jsonify({'error': 'Missing file path'}), 400
+    if not os.path.exists(os.path.join(OUTPUT_DIR, filepath)):
+        return jsonify({'error': 'File not found'}), 404
+    # 즐겨찾기로 고정된 파일은 용량 정리에서 제외
+    if retention.pin(filepath, data.get('userId')) == 'forbidden':
+        return jsonify({'error': 'File is pinned by another user'}), 403
+    return jsonify({'success': True, 'path': filepath})
+
+@app.route('/unpin_file', methods=['POST'])
+def unpin_file():
+    data = request.json or {}
+    filepath = data.get('path')
+    if not filepath:
+        return jsonify({'error': 'Missing file path'}), 400
+    # 다른 사용자의 즐겨찾기를 풀어 삭제 대상으로 만들 수 없도록 고정한 사용자만 해제 가능
+    result = retention.unpin(filepath, data.get('userId'))
+    if result == 'not_pinned':
+        return jsonify({'error': 'File is not pinned'}), 404
+    if result == 'forbidden':
+        return jsonify({'error': 'File is pinned by another user'}), 403
+    return jsonify({'success': True, 'path': filepath})
+
+@app.route('/pinned_files', methods=['GET'])
+def pinned_files():
+    return jsonify({'files': retention.pinned(request.args.get('userId'))})
+
+@app.route('/retention/report', methods=['GET'])
+def retention_report():
+    # 항상 dry run: 현재 정책으로 지워질 파일 목록만 돌려줌
+    return jsonify(retention.sweep(dry_run=True))
+
 @app.route('/save_prompt', methods=['POST'])
 def save_prompt():
     try:
@@ -274,6 +765,20 @@ def load_prompt():
         print(f"Error loading prompt: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def recover_jobs():
+    """이전 실행에서 끝나지 않은 작업을 ComfyUI 의 /queue, /history 와 맞춰 복구"""
+    def postprocess(job, outputs):
+        for output in outputs:
+            if output.endswith('.mp4'):
+                mp4_postprocessor.submit(os.path.join(OUTPUT_DIR, output), job['job_id'])
+
+    JobRecovery(job_store, on_completed=postprocess).reconcile()
+
 if __name__ == '__main__':
     config = load_config()
+    # debug 모드의 reloader 부모 프로세스에서는 복구하지 않음
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        recover_jobs()
+        retention.start(RETENTION_SWEEP_INTERVAL_S)
+        schema_cache.start(long_video_renderer.backends)
     app.run(debug=True, host='0.0.0.0', port=8888)
\ No newline at end of file
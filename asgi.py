@@ -0,0 +1,405 @@
+"""
+ASGI entry point.
+
+The render and prompt routes run on the asyncio clients, so a pending render
+only holds a WebSocket on the event loop instead of a blocked thread. All other
+routes are served by the existing Flask app mounted underneath, on a thread pool
+so that slow ones (video downloads, /backends) don't wait behind each other.
+
+Run with:  uvicorn asgi:app --host 0.0.0.0 --port 8888
+"""
+import asyncio
+import contextlib
+import json
+import os
+import uuid
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import (app as flask_app, parse_video_request, parse_long_video_request, parse_examples_request,
+                 parse_refine_request, parse_timeout, admission, admission_error, cancellations,
+                 cancelled_error, failed_error, register_job, job_store, recover_jobs, sse_event, mp4_postprocessor,
+                 retention, long_video_renderer, EXAMPLES_TIMEOUT_S, MIN_VIDEO_TIMEOUT_S,
+                 RETENTION_SWEEP_INTERVAL_S, MAX_LONG_VIDEO_JOB_S, LONG_VIDEO_USER_BUDGET_S)
+from async_clients import AsyncHunyuanVideoClient, AsyncFluxImageClient, AsyncPromptGenerator
+from tracing import tracer
+from cancellation import JobCancelled
+from workflow_schema import schema_cache
+from long_video import transition_frames
+from job_store import STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED
+
+# Flask 라우트를 동시에 처리할 스레드 수 (asgiref 의 WsgiToAsgi 는 한 스레드에서 차례로 처리함)
+WSGI_WORKERS = 64
+
+video_client = AsyncHunyuanVideoClient()
+image_client = AsyncFluxImageClient()
+prompt_generator = AsyncPromptGenerator()
+
+
+async def _read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def _cancel_on_disconnect(request, cancel_token):
+    """Cancel the job when the client goes away (ASGI http.disconnect)"""
+    while True:
+        message = await request.receive()
+        if message['type'] == 'http.disconnect':
+            await asyncio.to_thread(cancel_token.cancel, "client disconnected")
+            return
+
+
+async def _finish_job(job_id, status, outputs=None, error=None):
+    """job_store 는 동기 sqlite3 이므로 이벤트 루프 밖에서 기록"""
+    await asyncio.to_thread(job_store.finish, job_id, status, outputs, error)
+
+
+def _abandon_job(cancel_token, outputs=None, reason="request cancelled"):
+    """
+    The request task was cancelled (client gone, server shutting down): cancel the
+    ComfyUI prompt and record the job as cancelled without awaiting, since any
+    further await in a cancelled task may be interrupted again.
+    """
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, cancel_token.cancel, reason)
+    loop.run_in_executor(None, job_store.finish, cancel_token.job_id, STATUS_CANCELLED, outputs, reason)
+
+
+async def generate_prompt(request):
+    data = await _read_json(request)
+    if not data:
+        return JSONResponse({'error': 'No data provided'}, status_code=400)
+    if not isinstance(data, dict):
+        return JSONResponse({'error': 'Invalid data format'}, status_code=400)
+
+    try:
+        generated_prompt = await prompt_generator.generate(json.dumps(data))
+        return JSONResponse({
+            'success': True,
+            'generated_prompt': generated_prompt
+        })
+    except Exception as e:
+        print(f"Error generating prompt: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def generate_examples(request):
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate_examples")
+    data = await _read_json(request) or {}
+    params, error = parse_examples_request(data)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    folder_name = params['folder_name']
+
+    timeout_s, error = parse_timeout(data, EXAMPLES_TIMEOUT_S)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    cancel_token = await asyncio.to_thread(register_job, job_id, 'examples', data.get('userId'), params,
+                                           params['seed'], timeout_s)
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, cancel_token))
+
+    try:
+        with tracer.span(job_id, "handle /generate_examples"):
+            image_paths = await image_client.generate_images(
+                base_filename="example",
+                job_id=job_id,
+                cancel_token=cancel_token,
+                **params
+            )
+            relative_paths = [
+                os.path.join(folder_name, os.path.basename(path))
+                for path in image_paths
+            ]
+            await _finish_job(job_id, STATUS_COMPLETED, relative_paths)
+            return JSONResponse({
+                'success': True,
+                'job_id': job_id,
+                'seed': params['seed'],
+                'draft': params['draft'],
+                'image_paths': relative_paths
+            })
+    except asyncio.CancelledError:
+        _abandon_job(cancel_token)
+        raise
+    except JobCancelled as e:
+        await _finish_job(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        print(f"Error generating images: {str(e)}")
+        await _finish_job(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return JSONResponse(body, status_code=status)
+    finally:
+        watcher.cancel()
+        cancellations.remove(job_id)
+
+
+async def generate_examples_stream(request):
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate_examples/stream")
+    data = await _read_json(request) or {}
+    params, error = parse_examples_request(data)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    folder_name = params['folder_name']
+
+    timeout_s, error = parse_timeout(data, EXAMPLES_TIMEOUT_S)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    cancel_token = await asyncio.to_thread(register_job, job_id, 'examples', data.get('userId'), params,
+                                           params['seed'], timeout_s)
+
+    async def events():
+        relative_paths = []
+        finished = False
+        images = image_client.iter_images(
+            base_filename="example",
+            job_id=job_id,
+            cancel_token=cancel_token,
+            **params
+        )
+        try:
+            yield sse_event('job', {'job_id': job_id, 'seed': params['seed'], 'draft': params['draft']})
+            index = 0
+            async for path in images:
+                relative_path = os.path.join(folder_name, os.path.basename(path))
+                relative_paths.append(relative_path)
+                yield sse_event('image', {'index': index, 'path': relative_path})
+                index += 1
+
+            await _finish_job(job_id, STATUS_COMPLETED, relative_paths)
+            finished = True
+            yield sse_event('done', {'job_id': job_id, 'image_paths': relative_paths})
+        except JobCancelled as e:
+            await _finish_job(job_id, STATUS_CANCELLED, relative_paths, str(e))
+            finished = True
+            body, status = cancelled_error(e, cancel_token)
+            yield sse_event('error', dict(body, status=status))
+        except Exception as e:
+            print(f"Error generating images: {str(e)}")
+            await _finish_job(job_id, STATUS_FAILED, relative_paths, str(e))
+            finished = True
+            body, status = failed_error(e, job_id)
+            yield sse_event('error', dict(body, status=status))
+        finally:
+            if not finished:
+                # StreamingResponse 가 연결 끊김을 감지하면 이 제너레이터를 취소함.
+                # 취소된 상태에서는 await 가 다시 취소되므로 정리는 기다리지 않고 넘김
+                _abandon_job(cancel_token, relative_paths, "client disconnected")
+            cancellations.remove(job_id)
+            await images.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def refine_example(request):
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/refine_example")
+    data = await _read_json(request) or {}
+    params, error, status = await asyncio.to_thread(parse_refine_request, data)
+    if error:
+        return JSONResponse({'error': error}, status_code=status)
+
+    timeout_s, error = parse_timeout(data, EXAMPLES_TIMEOUT_S)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    cancel_token = await asyncio.to_thread(register_job, job_id, 'refine', data.get('userId'), params,
+                                           params['seed'], timeout_s)
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, cancel_token))
+
+    try:
+        with tracer.span(job_id, "handle /refine_example"):
+            refined_path = await image_client.refine_image(
+                image_path=os.path.join(image_client.base_output_dir, params['path']),
+                prompt=params['prompt'],
+                seed=params['seed'],
+                folder_name=params['folder_name'],
+                job_id=job_id,
+                cancel_token=cancel_token
+            )
+            relative_path = os.path.join(params['folder_name'], os.path.basename(refined_path))
+            await _finish_job(job_id, STATUS_COMPLETED, [relative_path])
+            return JSONResponse({
+                'success': True,
+                'job_id': job_id,
+                'seed': params['seed'],
+                'image_path': relative_path
+            })
+    except asyncio.CancelledError:
+        _abandon_job(cancel_token)
+        raise
+    except JobCancelled as e:
+        await _finish_job(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        print(f"Error refining image: {str(e)}")
+        await _finish_job(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return JSONResponse(body, status_code=status)
+    finally:
+        watcher.cancel()
+        cancellations.remove(job_id)
+
+
+async def generate_video(request):
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate")
+    data = await _read_json(request) or {}
+    params, error = parse_video_request(data)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+
+    decision = admission.admit(job_id, data.get('userId'), params, video_client.STEPS)
+    if not decision.admitted:
+        body, status, headers = admission_error(decision)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    timeout_s, error = parse_timeout(data, max(decision.eta_s * 2, MIN_VIDEO_TIMEOUT_S))
+    if error:
+        admission.release(job_id)
+        return JSONResponse({'error': error}, status_code=400)
+    cancel_token = await asyncio.to_thread(register_job, job_id, 'video', data.get('userId'), params,
+                                           params['seed'], timeout_s)
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, cancel_token))
+
+    succeeded = False
+    try:
+        with tracer.span(job_id, "handle /generate", seed=params['seed']):
+            video_path = await video_client.generate_video(
+                base_filename="video",
+                job_id=job_id,
+                cancel_token=cancel_token,
+                **params
+            )
+            succeeded = True
+            filename = os.path.basename(video_path)
+            folder = os.path.basename(os.path.dirname(video_path))
+            await _finish_job(job_id, STATUS_COMPLETED, [f"{folder}/{filename}"])
+            mp4_postprocessor.submit(video_path, job_id)
+            return JSONResponse({
+                'success': True,
+                'job_id': job_id,
+                'seed': params['seed'],
+                'filename': filename,
+                'folder': folder,
+                'admission': decision.to_dict()
+            })
+    except asyncio.CancelledError:
+        _abandon_job(cancel_token)
+        raise
+    except JobCancelled as e:
+        await _finish_job(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        await _finish_job(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return JSONResponse(body, status_code=status)
+    finally:
+        watcher.cancel()
+        cancellations.remove(job_id)
+        admission.release(job_id, succeeded)
+
+
+async def generate_long_video(request):
+    job_id = str(uuid.uuid4())
+    tracer.instant(job_id, "request_received", route="/generate_long")
+    data = await _read_json(request) or {}
+    params, error = parse_long_video_request(data)
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+
+    plan = long_video_renderer.plan(params['total_frames'], params['segment_frames'])
+    work = dict(params, frame_length=sum(segment['length'] for segment in plan))
+    decision = admission.admit(job_id, data.get('userId'), work, video_client.STEPS,
+                               parallelism=long_video_renderer.parallelism(plan),
+                               max_job_s=MAX_LONG_VIDEO_JOB_S,
+                               per_user_budget_s=LONG_VIDEO_USER_BUDGET_S)
+    if not decision.admitted:
+        body, status, headers = admission_error(decision)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    timeout_s, error = parse_timeout(data, max(decision.eta_s * 2, MIN_VIDEO_TIMEOUT_S))
+    if error:
+        admission.release(job_id)
+        return JSONResponse({'error': error}, status_code=400)
+    cancel_token = await asyncio.to_thread(register_job, job_id, 'long_video', data.get('userId'), params,
+                                           params['seed'], timeout_s)
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, cancel_token))
+
+    try:
+        with tracer.span(job_id, "handle /generate_long", seed=params['seed'], segments=len(plan)):
+            video_path = await long_video_renderer.render(
+                job_id=job_id,
+                cancel_token=cancel_token,
+                **params
+            )
+            filename = os.path.basename(video_path)
+            folder = os.path.basename(os.path.dirname(video_path))
+            await _finish_job(job_id, STATUS_COMPLETED, [f"{folder}/{filename}"])
+            mp4_postprocessor.submit(video_path, job_id)
+            return JSONResponse({
+                'success': True,
+                'job_id': job_id,
+                'seed': params['seed'],
+                'segments': len(plan),
+                'transitions': transition_frames(plan),
+                'overlap_frames': long_video_renderer.overlap_frames,
+                'filename': filename,
+                'folder': folder,
+                'admission': decision.to_dict()
+            })
+    except asyncio.CancelledError:
+        _abandon_job(cancel_token)
+        raise
+    except JobCancelled as e:
+        await _finish_job(job_id, STATUS_CANCELLED, error=str(e))
+        body, status = cancelled_error(e, cancel_token)
+        return JSONResponse(body, status_code=status)
+    except Exception as e:
+        await _finish_job(job_id, STATUS_FAILED, error=str(e))
+        body, status = failed_error(e, job_id)
+        return JSONResponse(body, status_code=status)
+    finally:
+        watcher.cancel()
+        cancellations.remove(job_id)
+        admission.release(job_id)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(recover_jobs)
+    retention.start(RETENTION_SWEEP_INTERVAL_S)
+    await asyncio.to_thread(schema_cache.start, long_video_renderer.backends)
+    yield
+    retention.stop()
+    schema_cache.stop()
+    await video_client.close()
+    await image_client.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/generate_prompt', generate_prompt, methods=['POST']),
+        Route('/generate_examples', generate_examples, methods=['POST']),
+        Route('/generate_examples/stream', generate_examples_stream, methods=['POST']),
+        Route('/refine_example', refine_example, methods=['POST']),
+        Route('/generate', generate_video, methods=['POST']),
+        Route('/generate_long', generate_long_video, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+    ],
+    lifespan=lifespan,
+)
\ No newline at end of file
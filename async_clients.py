@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import uuid
+from typing import Dict, Any, Optional, List, AsyncIterator, Callable
+
+import aiohttp
+import openai
+
+from hunyuan_client import HunyuanVideoClient
+from flux_s_client import FluxImageClient, is_complete_png
+from prompt_generator import PromptGenerator
+from tracing import tracer, NodeTimeline
+from cancellation import CancelToken
+from workflow_schema import schema_cache
+
+
+class AsyncComfyUIMixin:
+    """
+    Shared asyncio plumbing for the ComfyUI clients.
+    Each render opens its own WebSocket with a fresh client_id, so many renders
+    can be pending on one event loop without sharing connection state.
+    """
+
+    _session: Optional[aiohttp.ClientSession] = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def _ws_url(self, client_id: str) -> str:
+        return f"ws://{self.server_url.split('//')[1]}/ws?clientId={client_id}"
+
+    async def _check_cancel(self, cancel_token: Optional[CancelToken]):
+        # check() 가 ComfyUI 에 취소 요청을 보낼 수 있으므로 필요할 때만 스레드에서 실행
+        if cancel_token is not None and cancel_token.is_due():
+            await asyncio.to_thread(cancel_token.check)
+
+    def _deadline(self, timeout: int, cancel_token: Optional[CancelToken]) -> float:
+        """Loop-clock deadline: the job's own deadline if it has one, else the fixed timeout"""
+        loop = asyncio.get_running_loop()
+        if cancel_token is not None and cancel_token.remaining() is not None:
+            return loop.time() + cancel_token.remaining()
+        return loop.time() + timeout
+
+    async def _run_workflow(self, workflow: Dict[str, Any], job_id: Optional[str] = None,
+                            cancel_token: Optional[CancelToken] = None,
+                            submitted: Optional[asyncio.Future] = None) -> Dict[str, Any]:
+        """
+        Submit a workflow and wait until ComfyUI finishes it.
+        Returns the 'executed' outputs keyed by node id.
+        The optional submitted future is resolved with the prompt_id once the prompt is queued.
+        """
+        with tracer.span(job_id, "validate_workflow"):
+            await asyncio.to_thread(schema_cache.check, self.server_url, workflow)
+
+        session = await self._get_session()
+        client_id = str(uuid.uuid4())
+
+        # 프롬프트 전송 전에 연결 (HunyuanVideoClient.generate_video 참고)
+        async with session.ws_connect(self._ws_url(client_id), max_msg_size=0) as ws:
+            with tracer.span(job_id, "post_prompt", server=self.server_url):
+                async with session.post(f"{self.server_url}/prompt", json={
+                    "prompt": workflow,
+                    "client_id": client_id
+                }) as response:
+                    if response.status != 200:
+                        raise Exception(f"Failed to send prompt: {await response.text()}")
+                    prompt_id = (await response.json()).get("prompt_id")
+            if submitted is not None and not submitted.done():
+                submitted.set_result(prompt_id)
+
+            if cancel_token is not None:
+                await asyncio.to_thread(cancel_token.attach, self.server_url, prompt_id)
+
+            timeline = NodeTimeline(tracer, job_id)
+            outputs = {}
+            try:
+                while not ws.closed:
+                    await self._check_cancel(cancel_token)
+                    try:
+                        ws_msg = await ws.receive(timeout=1.0)
+                    except asyncio.TimeoutError:
+                        continue
+
+                    if ws_msg.type != aiohttp.WSMsgType.TEXT:
+                        # 미리보기 바이너리 프레임은 무시
+                        if ws_msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                           aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                        continue
+
+                    msg = json.loads(ws_msg.data)
+                    data = msg.get("data") or {}
+                    if prompt_id is not None and data.get("prompt_id") not in (None, prompt_id):
+                        continue
+                    timeline.on_message(msg)
+
+                    if msg["type"] == "executed":
+                        outputs[data.get("node")] = data.get("output") or {}
+                    elif msg["type"] in ("execution_interrupted", "execution_error"):
+                        await self._check_cancel(cancel_token)
+                        raise Exception(f"ComfyUI {msg['type'].replace('_', ' ')}: {data.get('exception_message', '')}")
+                    elif msg["type"] == "executing" and data.get("node") is None:
+                        return outputs
+            except asyncio.CancelledError:
+                # 요청 태스크가 취소되면 ComfyUI 쪽 작업도 정리
+                if cancel_token is not None:
+                    await asyncio.to_thread(cancel_token.cancel, "request cancelled")
+                raise
+            finally:
+                timeline.finish()
+
+        raise Exception("WebSocket closed before the prompt finished")
+
+    def _output_paths(self, outputs: Dict[str, Any], extension: str) -> List[str]:
+        """Resolve file paths reported in 'executed' outputs (SaveImage: images, VHS: gifs)"""
+        paths = []
+        for output in outputs.values():
+            for item in output.get("images", []) + output.get("gifs", []):
+                filename = item.get("filename", "")
+                if item.get("type", "output") == "output" and filename.endswith(extension):
+                    paths.append(os.path.join(self.base_output_dir, item.get("subfolder", ""), filename))
+        return paths
+
+    async def _wait_until_exist(self, paths: List[str], timeout: int,
+                                cancel_token: Optional[CancelToken] = None,
+                                exists: Callable[[str], bool] = os.path.exists):
+        loop = asyncio.get_running_loop()
+        deadline = self._deadline(timeout, cancel_token)
+        while not all(exists(p) for p in paths):
+            await self._check_cancel(cancel_token)
+            if loop.time() >= deadline:
+                await self._check_cancel(cancel_token)
+                raise TimeoutError("Output files were not written within the timeout period")
+            await asyncio.sleep(0.5)
+
+
+class AsyncHunyuanVideoClient(AsyncComfyUIMixin, HunyuanVideoClient):
+    async def generate_video(self, prompt: str, folder_name: str = "KTaivle", base_filename: str = "video",
+                             seed: Optional[int] = None, frame_length: int = 73,
+                             width: int = 848, height: int = 480, enable_upscale: bool = False,
+                             job_id: Optional[str] = None, cancel_token: Optional[CancelToken] = None) -> str:
+        folder_path = os.path.join(self.base_output_dir, folder_name)
+        os.makedirs(folder_path, exist_ok=True)
+
+        with tracer.span(job_id, "create_workflow"):
+            workflow = self._create_workflow(prompt, folder_name, base_filename, seed, frame_length, width, height, enable_upscale)
+
+        outputs = await self._run_workflow(workflow, job_id, cancel_token)
+
+        video_paths = self._output_paths(outputs, ".mp4")
+        if not video_paths:
+            raise Exception("ComfyUI reported no video output")
+        video_path = video_paths[-1]
+        with tracer.span(job_id, "detect_output_files"):
+            try:
+                await self._wait_until_exist([video_path], 180, cancel_token)
+            except TimeoutError as e:
+                raise Exception("Failed to detect new video file") from e
+
+        print(f"Generated video path: {video_path}")
+        return video_path
+
+
+class AsyncFluxImageClient(AsyncComfyUIMixin, FluxImageClient):
+    async def generate_images(self, prompt: str, folder_name: str = "flux_examples",
+                              base_filename: str = "example", seed: Optional[int] = None,
+                              batch_size: int = 4, job_id: Optional[str] = None,
+                              cancel_token: Optional[CancelToken] = None, draft: bool = False) -> List[str]:
+        """
+        Generate multiple images from a prompt
+        Returns a list of file paths to the generated images
+        """
+        image_paths = [path async for path in self.iter_images(prompt, folder_name, base_filename, seed, batch_size,
+                                                               job_id, cancel_token, draft=draft)]
+        print(f"Generated image paths: {image_paths}")
+        return image_paths
+
+    async def _upload_image(self, image_path: str, job_id: Optional[str] = None) -> str:
+        session = await self._get_session()
+        with open(image_path, "rb") as f:
+            image = f.read()
+        form = aiohttp.FormData()
+        form.add_field("image", image, filename=self._upload_name(image_path, job_id), content_type="image/png")
+        form.add_field("overwrite", "false")
+        async with session.post(f"{self.server_url}/upload/image", data=form) as response:
+            if response.status != 200:
+                raise Exception(f"Failed to upload image: {await response.text()}")
+            result = await response.json()
+        return f"{result['subfolder']}/{result['name']}" if result.get("subfolder") else result["name"]
+
+    async def refine_image(self, image_path: str, prompt: str, seed: int, folder_name: str = "flux_examples",
+                           base_filename: str = "refined", job_id: Optional[str] = None,
+                           cancel_token: Optional[CancelToken] = None) -> str:
+        """
+        Re-render one draft image at full resolution with the same prompt and seed
+        Returns the file path of the refined image
+        """
+        with tracer.span(job_id, "upload_image"):
+            image_name = await self._upload_image(image_path, job_id)
+        with tracer.span(job_id, "create_workflow", refine=True):
+            workflow = self._create_refine_workflow(prompt, image_name, folder_name, base_filename, seed)
+        refined_path = [path async for path in self._iter_workflow_images([workflow], job_id, cancel_token)][0]
+        print(f"Refined image path: {refined_path}")
+        return refined_path
+
+    def iter_images(self, prompt: str, folder_name: str = "flux_examples",
+                    base_filename: str = "example", seed: Optional[int] = None,
+                    batch_size: int = 4, job_id: Optional[str] = None,
+                    cancel_token: Optional[CancelToken] = None, timeout: int = 60,
+                    draft: bool = False) -> AsyncIterator[str]:
+        """Async counterpart of FluxImageClient.iter_images"""
+        workflows = self._example_workflows(prompt, folder_name, base_filename, seed, batch_size, job_id, draft)
+        return self._iter_workflow_images(workflows, job_id, cancel_token, timeout)
+
+    async def _iter_workflow_images(self, workflows: List[Dict[str, Any]], job_id: Optional[str] = None,
+                                    cancel_token: Optional[CancelToken] = None,
+                                    timeout: int = 60) -> AsyncIterator[str]:
+        """
+        Async counterpart of FluxImageClient._iter_workflow_images. Each prompt runs as its
+        own _run_workflow task, submitted one after another to keep the queue order.
+        """
+        loop = asyncio.get_running_loop()
+        runs = []
+        completed = False
+        try:
+            for index, workflow in enumerate(workflows):
+                if cancel_token is not None:
+                    token = cancel_token.child(f"image{index}")
+                else:
+                    token = CancelToken(f"{job_id}/image{index}")
+                submitted = loop.create_future()
+                runs.append(asyncio.create_task(self._run_workflow(workflow, job_id, token, submitted)))
+                # ComfyUI 큐 순서가 이미지 순서와 같도록 앞 프롬프트가 제출된 뒤에 다음 프롬프트 제출
+                await asyncio.wait({runs[-1], submitted}, return_when=asyncio.FIRST_COMPLETED)
+
+            for index, run in enumerate(runs):
+                outputs = await run
+                paths = self._output_paths(outputs, ".png")
+                if not paths:
+                    raise Exception("ComfyUI reported no image output")
+                with tracer.span(job_id, "detect_output_files", index=index):
+                    try:
+                        await self._wait_until_exist(paths, timeout, cancel_token, is_complete_png)
+                    except TimeoutError as e:
+                        raise Exception("Failed to detect new image files") from e
+                for path in paths:
+                    tracer.instant(job_id, "image_ready", path=os.path.basename(path))
+                    yield path
+            completed = True
+        finally:
+            # 소비자가 중간에 멈추거나 (연결 끊김 등) 한 프롬프트가 실패하면 남은 대기 태스크를 취소 -> ComfyUI 작업도 취소
+            if not completed:
+                for run in runs:
+                    if not run.done():
+                        run.cancel()
+
+
+class AsyncPromptGenerator(PromptGenerator):
+    def __init__(self):
+        super().__init__()
+        self.client = openai.AsyncOpenAI(api_key=self.api_key)
+
+    async def generate(self, prompt_data: str) -> str:
+        """GPT를 사용하여 프롬프트 생성 (비동기)"""
+        try:
+            processed_prompt = self._prepare_prompt(prompt_data)
+
+            response = await self.client.chat.completions.create(**self._completion_kwargs(processed_prompt))
+            generated_prompt = response.choices[0].message.content.strip()
+
+            await asyncio.to_thread(self._log_generation, prompt_data, generated_prompt)
+
+            return generated_prompt
+
+        except Exception as e:
+            print(f"Error generating prompt: {str(e)}")
+            raise
\ No newline at end of file
@@ -0,0 +1,181 @@
+import threading
+import time
+from typing import Dict, Optional, Iterator, Callable
+
+import requests
+
+DEADLINE_EXCEEDED = "deadline exceeded"
+
+
+class JobCancelled(Exception):
+    """Raised inside a render when its job was cancelled or ran past its deadline"""
+
+
+def cancel_comfy_prompt(server_url: str, prompt_id: str) -> str:
+    """
+    Remove a prompt from ComfyUI.
+    Pending prompts are deleted from the queue; the running one is interrupted.
+    Returns 'deleted', 'interrupted' or 'not_found'.
+    """
+    queue = requests.get(f"{server_url}/queue", timeout=10).json()
+
+    if any(item[1] == prompt_id for item in queue.get("queue_pending", [])):
+        requests.post(f"{server_url}/queue", json={"delete": [prompt_id]}, timeout=10)
+        return "deleted"
+
+    if any(item[1] == prompt_id for item in queue.get("queue_running", [])):
+        # /interrupt 는 실행 중인 작업 전체를 멈추므로 우리 프롬프트가 실행 중일 때만 호출
+        requests.post(f"{server_url}/interrupt", json={"prompt_id": prompt_id}, timeout=10)
+        return "interrupted"
+
+    return "not_found"
+
+
+class CancelToken:
+    """
+    Per-job cancellation handle shared by the route and the client.
+    Once the client has submitted a prompt it attaches the backend and prompt_id,
+    so cancel() can reach into ComfyUI no matter which thread calls it.
+    """
+
+    def __init__(self, job_id: str, deadline: Optional[float] = None,
+                 on_attach: Optional[Callable[[str, str], None]] = None):
+        self.job_id = job_id
+        self.deadline = deadline
+        self.on_attach = on_attach
+        self.reason = None
+        self.server_url = None
+        self.prompt_id = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._remote_cancelled = False
+        self._children = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def attach(self, server_url: str, prompt_id: str):
+        with self._lock:
+            self.server_url = server_url
+            self.prompt_id = prompt_id
+        if self.on_attach is not None:
+            try:
+                self.on_attach(server_url, prompt_id)
+            except Exception as e:
+                print(f"Error in attach callback for job {self.job_id}: {str(e)}")
+        # 제출 전에 이미 취소된 경우 바로 ComfyUI 에서도 제거
+        if self.cancelled:
+            self._cancel_remote()
+
+    def _cancel_remote(self):
+        with self._lock:
+            if self._remote_cancelled or self.prompt_id is None:
+                return
+            self._remote_cancelled = True
+            server_url, prompt_id = self.server_url, self.prompt_id
+        try:
+            result = cancel_comfy_prompt(server_url, prompt_id)
+            print(f"Cancelled prompt {prompt_id} on {server_url}: {result}")
+        except Exception as e:
+            print(f"Error cancelling prompt {prompt_id}: {str(e)}")
+
+    def cancel(self, reason: str = "cancelled"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            children = list(self._children)
+        self._cancel_remote()
+        for child in children:
+            child.cancel(reason)
+
+    def child(self, name: str) -> "CancelToken":
+        """
+        Token for one of several prompts rendered for this job (e.g. video segments).
+        It shares the deadline, and cancelling the job cancels every child.
+        """
+        token = CancelToken(f"{self.job_id}/{name}", self.deadline, self.on_attach)
+        with self._lock:
+            self._children.append(token)
+            cancelled, reason = self.cancelled, self.reason
+        if cancelled:
+            token.cancel(reason)
+        return token
+
+    def is_due(self) -> bool:
+        """True when check() would raise; cheap enough for an event loop"""
+        return self.cancelled or (self.deadline is not None and time.time() >= self.deadline)
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled or its deadline has passed"""
+        if not self.cancelled and self.deadline is not None and time.time() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} {self.reason}")
+
+
+def wait_deadline(timeout: float, cancel_token: Optional[CancelToken] = None) -> float:
+    """
+    time.time() deadline for an output wait: the job's own deadline when it has one,
+    otherwise the fixed timeout
+    """
+    if cancel_token is not None and cancel_token.deadline is not None:
+        return cancel_token.deadline
+    return time.time() + timeout
+
+
+class CancelRegistry:
+    """Live cancel tokens by job_id"""
+
+    def __init__(self):
+        self._tokens: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str, timeout_s: Optional[float] = None,
+               on_attach: Optional[Callable[[str, str], None]] = None) -> CancelToken:
+        deadline = time.time() + timeout_s if timeout_s is not None else None
+        token = CancelToken(job_id, deadline, on_attach)
+        with self._lock:
+            self._tokens[job_id] = token
+        return token
+
+    def get(self, job_id: str) -> Optional[CancelToken]:
+        with self._lock:
+            return self._tokens.get(job_id)
+
+    def cancel(self, job_id: str, reason: str = "cancelled by user") -> bool:
+        token = self.get(job_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def remove(self, job_id: str):
+        with self._lock:
+            self._tokens.pop(job_id, None)
+
+
+def cancel_on_close(stream: Iterator, token: CancelToken) -> Iterator:
+    """
+    Wrap a streaming response body so that a client disconnect cancels the job.
+    WSGI servers close the generator (GeneratorExit) when the connection drops.
+    """
+    completed = False
+    try:
+        for chunk in stream:
+            yield chunk
+        completed = True
+    finally:
+        if not completed:
+            token.cancel("client disconnected")
+            # 내부 제너레이터도 바로 정리 (WebSocket 닫기 등)
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
\ No newline at end of file
@@ -13,4 +13,20 @@ def load_config(config_file='IP_PORT_ADDRESS.txt'):
     if 'IP' not in config or 'PORT' not in config:
         raise Exception("IP or PORT not found in config file")
     
-    return config
\ No newline at end of file
+    return config
+
+def load_backends(config_file='IP_PORT_ADDRESS.txt'):
+    """
+    ComfyUI server URLs. The IP/PORT server comes first (its output folder is the
+    local one); BACKENDS=ip:port,ip:port adds more servers for parallel renders.
+    """
+    config = load_config(config_file)
+    backends = [f"http://{config['IP']}:{config['PORT']}"]
+    for backend in config.get('BACKENDS', '').split(','):
+        backend = backend.strip()
+        if not backend:
+            continue
+        url = backend if backend.startswith('http') else f"http://{backend}"
+        if url not in backends:
+            backends.append(url)
+    return backends
\ No newline at end of file
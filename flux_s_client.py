@@ -3,12 +3,33 @@ import websocket
 import requests
 import uuid
 import os
-import glob
 import time
 from config import load_config
-from typing import Dict, Any, Optional, Set, List
+from tracing import tracer, NodeTimeline
+from cancellation import CancelToken, wait_deadline
+from workflow_schema import schema_cache
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+# PNG 파일의 마지막 청크 (IEND) - 이 바이트로 끝나면 파일 쓰기가 끝난 것
+PNG_TRAILER = b"IEND\xaeB`\x82"
+
+def is_complete_png(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            f.seek(-len(PNG_TRAILER), os.SEEK_END)
+            return f.read() == PNG_TRAILER
+    except OSError:
+        return False
 
 class FluxImageClient:
+    # 최종 해상도/스텝 수와 방향을 고르기 위한 초안(draft) 해상도/스텝 수
+    FULL_SIZE = 1024
+    FULL_STEPS = 6
+    DRAFT_SIZE = 512
+    DRAFT_STEPS = 4
+    # refine 시 초안 구도를 유지하면서 디테일을 다시 그리는 정도
+    REFINE_DENOISE = 0.6
+
     def __init__(self, server_url: str = None, 
                  base_output_dir: str = r"D:\ComfyUI_windows_portable\ComfyUI\output"):
         if server_url is None:
@@ -16,43 +37,20 @@ class FluxImageClient:
             server_url = f"http://{config['IP']}:{config['PORT']}"
         self.server_url = server_url
         self.base_output_dir = base_output_dir
-        self.client_id = str(uuid.uuid4())
-        self.ws = None
-
-    def _connect_websocket(self):
-        ws_url = f"ws://{self.server_url.split('//')[1]}/ws?clientId={self.client_id}"
-        self.ws = websocket.WebSocket()
-        self.ws.connect(ws_url)
-
-    def _get_existing_files(self, folder_name: str) -> Set[str]:
-        folder_path = os.path.join(self.base_output_dir, folder_name)
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path, exist_ok=True)
-        pattern = os.path.join(folder_path, "*.png")
-        return set(os.path.basename(f) for f in glob.glob(pattern))
-
-    def _wait_for_new_files(self, folder_name: str, existing_files: Set[str], count: int = 4, timeout: int = 60) -> List[str]:
-        """Wait for multiple new files to be generated"""
-        start_time = time.time()
-        folder_path = os.path.join(self.base_output_dir, folder_name)
-        new_files = []
-        
-        while time.time() - start_time < timeout and len(new_files) < count:
-            current_files = self._get_existing_files(folder_name)
-            new_files = sorted([
-                os.path.join(folder_path, f) 
-                for f in current_files - existing_files
-            ], key=lambda x: os.path.getctime(x))
-            if len(new_files) < count:
-                time.sleep(0.5)
-                
-        if len(new_files) < count:
-            raise TimeoutError(f"Only {len(new_files)} of {count} files were detected within timeout")
-            
-        return new_files
+
+    def _connect_websocket(self) -> Tuple[str, websocket.WebSocket]:
+        """
+        Open a WebSocket under a fresh client_id. Every render gets its own, because
+        ComfyUI keeps one socket per client_id and the client is shared across requests.
+        """
+        client_id = str(uuid.uuid4())
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://{self.server_url.split('//')[1]}/ws?clientId={client_id}")
+        return client_id, ws
 
     def _create_workflow(self, prompt: str, folder_name: str, base_filename: str = "example",
-                        seed: Optional[int] = None, batch_size: int = 4) -> Dict[str, Any]:
+                        seed: Optional[int] = None, batch_size: int = 4, draft: bool = False) -> Dict[str, Any]:
+        size = self.DRAFT_SIZE if draft else self.FULL_SIZE
         workflow = {
             "8": {
                 "inputs": {
@@ -70,8 +68,8 @@ class FluxImageClient:
             },
             "27": {
                 "inputs": {
-                    "width": 1024,
-                    "height": 1024,
+                    "width": size,
+                    "height": size,
                     "batch_size": batch_size
                 },
                 "class_type": "EmptySD3LatentImage"
@@ -85,7 +83,7 @@ class FluxImageClient:
             "31": {
                 "inputs": {
                     "seed": seed if seed is not None else int(time.time() * 1000) % (2**32),
-                    "steps": 6,
+                    "steps": self.DRAFT_STEPS if draft else self.FULL_STEPS,
                     "cfg": 1,
                     "sampler_name": "euler",
                     "scheduler": "simple",
@@ -147,42 +145,202 @@ class FluxImageClient:
         }
         return workflow
 
-    def generate_images(self, prompt: str, folder_name: str = "flux_examples", 
-                       base_filename: str = "example", seed: Optional[int] = None, 
-                       batch_size: int = 4) -> List[str]:
+    def _create_refine_workflow(self, prompt: str, image_name: str, folder_name: str,
+                                base_filename: str = "refined", seed: Optional[int] = None) -> Dict[str, Any]:
         """
-        Generate multiple images from a prompt
-        Returns a list of file paths to the generated images
+        Full-resolution pass over a chosen draft: the draft is upscaled, encoded and
+        partially re-noised with the same seed, so the composition the user picked is kept
         """
-        folder_path = os.path.join(self.base_output_dir, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-        
-        existing_files = self._get_existing_files(folder_name)
-        workflow = self._create_workflow(prompt, folder_name, base_filename, seed, batch_size)
-        
-        prompt_url = f"{self.server_url}/prompt"
-        response = requests.post(prompt_url, json={
-            "prompt": workflow,
-            "client_id": self.client_id
-        })
-        
+        workflow = self._create_workflow(prompt, folder_name, base_filename, seed, batch_size=1)
+        del workflow["27"]
+        workflow["50"] = {
+            "inputs": {
+                "image": image_name
+            },
+            "class_type": "LoadImage"
+        }
+        workflow["51"] = {
+            "inputs": {
+                "upscale_method": "lanczos",
+                "width": self.FULL_SIZE,
+                "height": self.FULL_SIZE,
+                "crop": "disabled",
+                "image": ["50", 0]
+            },
+            "class_type": "ImageScale"
+        }
+        workflow["52"] = {
+            "inputs": {
+                "pixels": ["51", 0],
+                "vae": ["30", 2]
+            },
+            "class_type": "VAEEncode"
+        }
+        workflow["31"]["inputs"]["latent_image"] = ["52", 0]
+        workflow["31"]["inputs"]["denoise"] = self.REFINE_DENOISE
+        return workflow
+
+    def _upload_name(self, image_path: str, job_id: Optional[str] = None) -> str:
+        # 다른 폴더의 초안도 같은 파일명 (example_00001_.png) 을 쓰므로 작업마다 고유한 이름으로 업로드
+        return f"{job_id or uuid.uuid4()}_{os.path.basename(image_path)}"
+
+    def _upload_image(self, image_path: str, job_id: Optional[str] = None) -> str:
+        """Copy a local image into ComfyUI's input folder; returns the name LoadImage expects"""
+        with open(image_path, "rb") as f:
+            response = requests.post(f"{self.server_url}/upload/image",
+                                     files={"image": (self._upload_name(image_path, job_id), f, "image/png")},
+                                     data={"overwrite": "false"})
         if response.status_code != 200:
-            raise Exception(f"Failed to send prompt: {response.text}")
+            raise Exception(f"Failed to upload image: {response.text}")
+        result = response.json()
+        return f"{result['subfolder']}/{result['name']}" if result.get("subfolder") else result["name"]
+
+    def _example_workflows(self, prompt: str, folder_name: str, base_filename: str, seed: Optional[int],
+                           batch_size: int, job_id: Optional[str] = None, draft: bool = False) -> List[Dict[str, Any]]:
+        """
+        One single-image workflow per example, seeded seed, seed+1, ... Queued as separate
+        prompts, each image can be returned as soon as its prompt finishes instead of
+        after the whole batch, and image i can be refined again with seed + i.
+        """
+        if seed is None:
+            seed = int(time.time() * 1000) % (2**32)
+        with tracer.span(job_id, "create_workflow", draft=draft):
+            return [self._create_workflow(prompt, folder_name, base_filename, seed + index, 1, draft)
+                    for index in range(batch_size)]
+
+    def iter_images(self, prompt: str, folder_name: str = "flux_examples",
+                    base_filename: str = "example", seed: Optional[int] = None,
+                    batch_size: int = 4, job_id: Optional[str] = None,
+                    cancel_token: Optional[CancelToken] = None, timeout: int = 60,
+                    draft: bool = False) -> Iterator[str]:
+        """Generate multiple images from a prompt, yielding each path as soon as it is written"""
+        workflows = self._example_workflows(prompt, folder_name, base_filename, seed, batch_size, job_id, draft)
+        return self._iter_workflow_images(workflows, job_id, cancel_token, timeout)
 
-        self._connect_websocket()
+    def _output_images(self, output: Dict[str, Any]) -> List[str]:
+        """Paths of the PNGs listed in a SaveImage 'executed' output"""
+        return [
+            os.path.join(self.base_output_dir, item.get("subfolder", ""), item["filename"])
+            for item in output.get("images", [])
+            if item.get("type", "output") == "output" and item.get("filename", "").endswith(".png")
+        ]
+
+    def _iter_workflow_images(self, workflows: List[Dict[str, Any]], job_id: Optional[str] = None,
+                              cancel_token: Optional[CancelToken] = None, timeout: int = 60) -> Iterator[str]:
+        """
+        Queue the workflows in order and yield their images in the same order.
+        Only files reported in this job's own 'executed' outputs are returned,
+        so concurrent jobs writing into the same folder never see each other's images.
+        """
+        with tracer.span(job_id, "validate_workflow"):
+            for workflow in workflows:
+                schema_cache.check(self.server_url, workflow)
         
+        client_id, ws = self._connect_websocket()
+        # 파일 검사와 취소 확인을 위해 recv 에 짧은 타임아웃 설정
+        ws.settimeout(0.25)
+        timeline = NodeTimeline(tracer, job_id)
+        
+        # 프롬프트마다 취소 토큰을 두어 작업 취소/실패 시 남은 프롬프트도 ComfyUI 에서 제거
+        tokens = []
+        prompt_ids = []
+        outputs: Dict[str, List[str]] = {}
+        completed = False
         try:
-            while True:
-                msg = json.loads(self.ws.recv())
-                if msg["type"] == "executed":
+            for index, workflow in enumerate(workflows):
+                if cancel_token is not None:
+                    token = cancel_token.child(f"image{index}")
+                else:
+                    token = CancelToken(f"{job_id}/image{index}")
+                tokens.append(token)
+                with tracer.span(job_id, "post_prompt", server=self.server_url, index=index):
+                    response = requests.post(f"{self.server_url}/prompt", json={
+                        "prompt": workflow,
+                        "client_id": client_id
+                    })
+                if response.status_code != 200:
+                    raise Exception(f"Failed to send prompt: {response.text}")
+                prompt_id = response.json().get("prompt_id")
+                prompt_ids.append(prompt_id)
+                token.attach(self.server_url, prompt_id)
+            
+            for index, prompt_id in enumerate(prompt_ids):
+                while prompt_id not in outputs:
+                    if cancel_token is not None:
+                        cancel_token.check()
                     try:
-                        image_paths = self._wait_for_new_files(folder_name, existing_files, batch_size)
-                        print(f"Generated image paths: {image_paths}")
-                        return image_paths
-                    except TimeoutError as e:
-                        raise Exception("Failed to detect new image files") from e
+                        msg = json.loads(ws.recv())
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    data = msg.get("data") or {}
+                    if data.get("prompt_id") not in prompt_ids:
+                        continue
+                    timeline.on_message(msg)
+                    if msg["type"] in ("execution_interrupted", "execution_error"):
+                        if cancel_token is not None:
+                            cancel_token.check()
+                        raise Exception(f"ComfyUI {msg['type'].replace('_', ' ')}: {data.get('exception_message', '')}")
+                    if msg["type"] == "executed":
+                        outputs.setdefault(data["prompt_id"], []).extend(self._output_images(data.get("output") or {}))
+                    elif msg["type"] == "executing" and data.get("node") is None:
+                        # 출력 없이 끝난 프롬프트
+                        outputs.setdefault(data["prompt_id"], [])
+                
+                paths = outputs[prompt_id]
+                if not paths:
+                    raise Exception("ComfyUI reported no image output")
+                with tracer.span(job_id, "detect_output_files", index=index):
+                    self._wait_until_complete(paths, timeout, cancel_token)
+                for path in paths:
+                    tracer.instant(job_id, "image_ready", path=os.path.basename(path))
+                    yield path
+            completed = True
         finally:
-            self.ws.close()
+            if not completed:
+                # 중간에 실패하거나 소비자가 멈추면 아직 끝나지 않은 프롬프트를 정리
+                for token, prompt_id in zip(tokens, prompt_ids):
+                    if prompt_id not in outputs:
+                        token.cancel("job ended")
+            timeline.finish()
+            ws.close()
+
+    def _wait_until_complete(self, paths: List[str], timeout: int, cancel_token: Optional[CancelToken] = None):
+        """Wait until every PNG is fully written (output folders may be on a network share)"""
+        deadline = wait_deadline(timeout, cancel_token)
+        while not all(is_complete_png(path) for path in paths):
+            if cancel_token is not None:
+                cancel_token.check()
+            if time.time() >= deadline:
+                raise Exception("Failed to detect new image files: not written within timeout")
+            time.sleep(0.25)
+
+    def generate_images(self, prompt: str, folder_name: str = "flux_examples", 
+                       base_filename: str = "example", seed: Optional[int] = None, 
+                       batch_size: int = 4, job_id: Optional[str] = None,
+                       cancel_token: Optional[CancelToken] = None, draft: bool = False) -> List[str]:
+        """
+        Generate multiple images from a prompt
+        Returns a list of file paths to the generated images
+        """
+        image_paths = list(self.iter_images(prompt, folder_name, base_filename, seed, batch_size,
+                                            job_id, cancel_token, draft=draft))
+        print(f"Generated image paths: {image_paths}")
+        return image_paths
+
+    def refine_image(self, image_path: str, prompt: str, seed: int, folder_name: str = "flux_examples",
+                     base_filename: str = "refined", job_id: Optional[str] = None,
+                     cancel_token: Optional[CancelToken] = None) -> str:
+        """
+        Re-render one draft image at full resolution with the same prompt and seed
+        Returns the file path of the refined image
+        """
+        with tracer.span(job_id, "upload_image"):
+            image_name = self._upload_image(image_path, job_id)
+        with tracer.span(job_id, "create_workflow", refine=True):
+            workflow = self._create_refine_workflow(prompt, image_name, folder_name, base_filename, seed)
+        refined_path = list(self._iter_workflow_images([workflow], job_id, cancel_token))[0]
+        print(f"Refined image path: {refined_path}")
+        return refined_path
 
 def main():
     client = FluxImageClient()
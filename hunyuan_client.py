@@ -4,12 +4,17 @@ import requests
 import websocket
 import uuid
 import os
-import glob
 import time
-from typing import Dict, Any, Optional, Set
+from typing import Dict, Any, Optional, List, Tuple
 from config import load_config
+from tracing import tracer, NodeTimeline
+from cancellation import CancelToken, wait_deadline
+from workflow_schema import schema_cache
 
 class HunyuanVideoClient:
+    STEPS = 8
+    FRAME_RATE = 24
+
     def __init__(self, server_url: str = None, 
                  base_output_dir: str = r"D:\ComfyUI_windows_portable\ComfyUI\output"):
         if server_url is None:
@@ -17,33 +22,32 @@ class HunyuanVideoClient:
             server_url = f"http://{config['IP']}:{config['PORT']}"
         self.server_url = server_url
         self.base_output_dir = base_output_dir
-        self.client_id = str(uuid.uuid4())
-        self.ws = None
 
-    def _connect_websocket(self):
-        ws_url = f"ws://{self.server_url.split('//')[1]}/ws?clientId={self.client_id}"
-        self.ws = websocket.WebSocket()
-        self.ws.connect(ws_url)
+    def _connect_websocket(self) -> Tuple[str, websocket.WebSocket]:
+        """Fresh client_id and WebSocket for one render (see FluxImageClient._connect_websocket)"""
+        client_id = str(uuid.uuid4())
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://{self.server_url.split('//')[1]}/ws?clientId={client_id}")
+        return client_id, ws
 
-    def _get_existing_files(self, folder_name: str) -> Set[str]:
-        folder_path = os.path.join(self.base_output_dir, folder_name)
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path, exist_ok=True)
-        pattern = os.path.join(folder_path, "*.mp4")
-        return set(os.path.basename(f) for f in glob.glob(pattern))
+    def _output_videos(self, outputs: Dict[str, Any]) -> List[str]:
+        """Paths of the MP4s listed in VHS_VideoCombine 'executed' outputs (gifs)"""
+        return [
+            os.path.join(self.base_output_dir, item.get("subfolder", ""), item["filename"])
+            for output in outputs.values()
+            for item in output.get("gifs", [])
+            if item.get("type", "output") == "output" and item.get("filename", "").endswith(".mp4")
+        ]
 
-    def _wait_for_new_file(self, folder_name: str, existing_files: Set[str], timeout: int = 180) -> str:
-        start_time = time.time()
-        folder_path = os.path.join(self.base_output_dir, folder_name)
-        
-        while time.time() - start_time < timeout:
-            current_files = self._get_existing_files(folder_name)
-            new_files = current_files - existing_files
-            if new_files:
-                newest_file = max(new_files, key=lambda x: os.path.getctime(os.path.join(folder_path, x)))
-                return os.path.join(folder_path, newest_file)
+    def _wait_until_written(self, path: str, timeout: int = 180, cancel_token: Optional[CancelToken] = None):
+        """Wait until the reported video exists (output folders may be on a network share)"""
+        deadline = wait_deadline(timeout, cancel_token)
+        while not os.path.exists(path):
+            if cancel_token is not None:
+                cancel_token.check()
+            if time.time() >= deadline:
+                raise TimeoutError("Video file was not written within the timeout period")
             time.sleep(0.5)
-        raise TimeoutError("New video file was not detected within the timeout period")
 
     def _get_upscale_resolution(self, width: int, height: int) -> tuple[int, int]:
         aspect_ratio = width / height
@@ -108,7 +112,7 @@ class HunyuanVideoClient:
             "17": {
                 "inputs": {
                     "scheduler": "simple",
-                    "steps": 8,
+                    "steps": self.STEPS,
                     "denoise": 1,
                     "model": ["12", 0]
                 },
@@ -210,9 +214,14 @@ class HunyuanVideoClient:
         else:
             video_input = ["73", 0]
 
-        workflow["75"] = {
+        workflow["75"] = self._video_combine_node(folder_name, base_filename, video_input)
+
+        return workflow
+
+    def _video_combine_node(self, folder_name: str, base_filename: str, images: list) -> Dict[str, Any]:
+        return {
             "inputs": {
-                "frame_rate": 24,
+                "frame_rate": self.FRAME_RATE,
                 "loop_count": 0,
                 "filename_prefix": f"{folder_name}/{base_filename}",
                 "format": "video/nvenc_h264-mp4",
@@ -222,46 +231,82 @@ class HunyuanVideoClient:
                 "save_metadata": False,
                 "pingpong": False,
                 "save_output": True,
-                "images": video_input
+                "images": images
             },
             "class_type": "VHS_VideoCombine"
         }
 
-        return workflow
-
     def generate_video(self, prompt: str, folder_name: str = "KTaivle", base_filename: str = "video",
                       seed: Optional[int] = None, frame_length: int = 73, 
-                      width: int = 848, height: int = 480, enable_upscale: bool = False) -> str:
+                      width: int = 848, height: int = 480, enable_upscale: bool = False,
+                      job_id: Optional[str] = None, cancel_token: Optional[CancelToken] = None) -> str:
         folder_path = os.path.join(self.base_output_dir, folder_name)
         os.makedirs(folder_path, exist_ok=True)
         
-        existing_files = self._get_existing_files(folder_name)
-
-        workflow = self._create_workflow(prompt, folder_name, base_filename, seed, frame_length, width, height, enable_upscale)
+        with tracer.span(job_id, "create_workflow"):
+            workflow = self._create_workflow(prompt, folder_name, base_filename, seed, frame_length, width, height, enable_upscale)
         
-        prompt_url = f"{self.server_url}/prompt"
-        response = requests.post(prompt_url, json={
-            "prompt": workflow,
-            "client_id": self.client_id
-        })
+        # 노드/모델이 없는 워크플로는 GPU 큐에 넣기 전에 바로 실패
+        with tracer.span(job_id, "validate_workflow"):
+            schema_cache.check(self.server_url, workflow)
         
-        if response.status_code != 200:
-            raise Exception(f"Failed to send prompt: {response.text}")
-
-        self._connect_websocket()
+        # 캐시된 프롬프트는 바로 끝날 수 있으므로 메시지를 놓치지 않도록 프롬프트 전송 전에 WebSocket 연결
+        client_id, ws = self._connect_websocket()
+        # 취소/마감 시간을 주기적으로 확인할 수 있도록 recv 에 타임아웃 설정
+        ws.settimeout(1.0)
+        timeline = NodeTimeline(tracer, job_id)
+        outputs = {}
         
         try:
+            prompt_url = f"{self.server_url}/prompt"
+            with tracer.span(job_id, "post_prompt", server=self.server_url):
+                response = requests.post(prompt_url, json={
+                    "prompt": workflow,
+                    "client_id": client_id
+                })
+            
+            if response.status_code != 200:
+                raise Exception(f"Failed to send prompt: {response.text}")
+
+            prompt_id = response.json().get("prompt_id")
+            if cancel_token is not None:
+                cancel_token.attach(self.server_url, prompt_id)
+
             while True:
-                msg = json.loads(self.ws.recv())
+                if cancel_token is not None:
+                    cancel_token.check()
+                try:
+                    msg = json.loads(ws.recv())
+                except websocket.WebSocketTimeoutException:
+                    continue
+                data = msg.get("data") or {}
+                if prompt_id is not None and data.get("prompt_id") not in (None, prompt_id):
+                    continue
+                timeline.on_message(msg)
+                if msg["type"] in ("execution_interrupted", "execution_error"):
+                    if cancel_token is not None:
+                        cancel_token.check()
+                    raise Exception(f"ComfyUI {msg['type'].replace('_', ' ')}: {data.get('exception_message', '')}")
                 if msg["type"] == "executed":
-                    try:
-                        video_path = self._wait_for_new_file(folder_name, existing_files)
-                        print(f"Generated video path: {video_path}")
-                        return video_path
-                    except TimeoutError as e:
-                        raise Exception("Failed to detect new video file") from e
+                    outputs[data.get("node")] = data.get("output") or {}
+                elif msg["type"] == "executing" and data.get("node") is None:
+                    break
         finally:
-            self.ws.close()
+            timeline.finish()
+            ws.close()
+
+        # 폴더를 훑지 않고 이 프롬프트의 출력에 적힌 파일만 사용 (다른 작업의 mp4 를 집지 않도록)
+        video_paths = self._output_videos(outputs)
+        if not video_paths:
+            raise Exception("ComfyUI reported no video output")
+        video_path = video_paths[-1]
+        try:
+            with tracer.span(job_id, "detect_output_files"):
+                self._wait_until_written(video_path, cancel_token=cancel_token)
+        except TimeoutError as e:
+            raise Exception("Failed to detect new video file") from e
+        print(f"Generated video path: {video_path}")
+        return video_path
 
 def main():
     client = HunyuanVideoClient()
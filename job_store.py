@@ -0,0 +1,156 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+# 작업 상태
+STATUS_QUEUED = "queued"        # 접수됨, 아직 ComfyUI 에 제출 전
+STATUS_RUNNING = "running"      # ComfyUI 에 제출됨 (prompt_id 있음)
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+UNFINISHED_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id     TEXT PRIMARY KEY,
+    kind       TEXT NOT NULL,
+    user_id    TEXT,
+    params     TEXT NOT NULL,
+    seed       INTEGER,
+    backend    TEXT,
+    prompt_id  TEXT,
+    status     TEXT NOT NULL,
+    outputs    TEXT,
+    error      TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS job_prompts (
+    job_id    TEXT NOT NULL,
+    position  INTEGER NOT NULL,
+    backend   TEXT NOT NULL,
+    prompt_id TEXT NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+"""
+
+
+class JobStore:
+    """
+    Render jobs persisted in an embedded SQLite database (write-ahead logging),
+    so results can be found again after a restart or a dropped connection.
+    """
+
+    def __init__(self, db_path: str = "jobs.db"):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["outputs"] = json.loads(job["outputs"]) if job["outputs"] else []
+        return job
+
+    def create(self, job_id: str, kind: str, params: Dict[str, Any], user_id: Optional[str] = None,
+               seed: Optional[int] = None):
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (job_id, kind, user_id, params, seed, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, user_id, json.dumps(params), seed, STATUS_QUEUED, now, now)
+        )
+
+    def mark_running(self, job_id: str, backend: str, prompt_id: str):
+        """
+        Record a submitted prompt. Jobs rendered as several prompts (one per example
+        image) call this once per prompt, in submission order; jobs.prompt_id keeps the latest.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET backend = ?, prompt_id = ?, status = ?, updated_at = ? WHERE job_id = ?",
+                    (backend, prompt_id, STATUS_RUNNING, time.time(), job_id)
+                )
+                self._conn.execute(
+                    "INSERT INTO job_prompts (job_id, position, backend, prompt_id) "
+                    "SELECT ?, COUNT(*), ?, ? FROM job_prompts WHERE job_id = ?",
+                    (job_id, backend, prompt_id, job_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def prompts(self, job_id: str) -> List[Dict[str, str]]:
+        """Every prompt submitted for a job (backend, prompt_id) in submission order"""
+        rows = self._execute(
+            "SELECT backend, prompt_id FROM job_prompts WHERE job_id = ? ORDER BY position",
+            (job_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def finish(self, job_id: str, status: str, outputs: Optional[List[str]] = None,
+               error: Optional[str] = None):
+        self._execute(
+            "UPDATE jobs SET status = ?, outputs = ?, error = ?, updated_at = ? WHERE job_id = ?",
+            (status, json.dumps(outputs or []), error, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        return self._to_dict(rows[0]) if rows else None
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in UNFINISHED_STATUSES)
+        rows = self._execute(
+            f"SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at",
+            UNFINISHED_STATUSES
+        )
+        jobs = [self._to_dict(row) for row in rows]
+        for job in jobs:
+            job["prompts"] = self.prompts(job["job_id"])
+        return jobs
+
+    def completed_outputs(self) -> Dict[str, Dict[str, Any]]:
+        """Output path (folder/filename) -> job_id and user_id, for every file a completed job wrote"""
+        rows = self._execute(
+            "SELECT job_id, user_id, outputs FROM jobs WHERE status = ? AND outputs IS NOT NULL",
+            (STATUS_COMPLETED,)
+        )
+        files = {}
+        for row in rows:
+            for path in json.loads(row["outputs"]):
+                if path is not None:
+                    files[path.replace("\\", "/")] = {"job_id": row["job_id"], "user_id": row["user_id"]}
+        return files
+
+    def mark_evicted(self, job_id: str, paths: List[str]):
+        """Replace deleted output files with null, keeping the position of the others (image index)"""
+        with self._lock:
+            row = self._conn.execute("SELECT outputs FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or not row["outputs"]:
+                return
+            evicted = set(paths)
+            outputs = [
+                None if path is not None and path.replace("\\", "/") in evicted else path
+                for path in json.loads(row["outputs"])
+            ]
+            self._conn.execute(
+                "UPDATE jobs SET outputs = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(outputs), time.time(), job_id)
+            )
\ No newline at end of file
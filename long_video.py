@@ -0,0 +1,267 @@
+"""
+Long-form video: one request is split into temporal segments that are rendered
+concurrently on every configured ComfyUI backend, then joined locally with ffmpeg.
+
+Consecutive segments overlap by a few frames and are cross-faded over the overlap.
+Every segment is an independent text-to-video render (nothing conditions a segment
+on the previous one's last frames), so each boundary is a short dissolve between
+two takes of the same prompt rather than one continuous shot.
+"""
+import asyncio
+import math
+import os
+import shutil
+import subprocess
+import time
+from typing import Dict, Any, Optional, List
+
+import aiohttp
+
+from async_clients import AsyncHunyuanVideoClient
+from tracing import tracer
+from cancellation import CancelToken, DEADLINE_EXCEEDED
+from workflow_schema import schema_cache
+
+
+def _frame_length(frames: int) -> int:
+    """Smallest 4k+1 length (as EmptyHunyuanLatentVideo expects) with at least this many frames"""
+    return frames + (-(frames - 1)) % 4
+
+
+def plan_segments(total_frames: int, segment_frames: int, overlap_frames: int = 0,
+                  min_frames: int = 1) -> List[Dict[str, int]]:
+    """
+    Equal-length segments that, overlapping by overlap_frames, cover exactly total_frames.
+    Each entry has the frame of the joined video where the segment starts, its rendered
+    'length' (4k+1, at least min_frames when there are several) and the number of frames
+    to 'keep'; only the last one is trimmed, by at most a few frames.
+    """
+    if total_frames <= segment_frames:
+        count = 1
+    else:
+        count = math.ceil((total_frames - overlap_frames) / (segment_frames - overlap_frames))
+    # 마지막 구간만 몇 프레임짜리로 남지 않도록 필요한 프레임을 구간마다 고르게 나눔
+    length = _frame_length(math.ceil((total_frames + overlap_frames * (count - 1)) / count))
+    if count > 1:
+        length = max(length, _frame_length(min_frames))
+    segments = []
+    for index in range(count):
+        start = index * (length - overlap_frames)
+        segments.append({"start": start, "length": length, "keep": min(length, total_frames - start)})
+    return segments
+
+
+def transition_frames(plan: List[Dict[str, int]]) -> List[int]:
+    """Frame indices in the joined video where a cross-fade into the next segment starts"""
+    return [segment["start"] for segment in plan[1:]]
+
+
+def _ffmpeg_exe() -> str:
+    path = shutil.which("ffmpeg")
+    if path is not None:
+        return path
+    try:
+        # ComfyUI 의 VideoHelperSuite 가 설치하는 ffmpeg 바이너리
+        import imageio_ffmpeg
+    except ImportError:
+        raise Exception("ffmpeg is required to join long video segments")
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+class LongVideoRenderer:
+    """
+    Renders a long clip as segments spread over several backends.
+    Every segment uses the same prompt and a seed derived from the job seed
+    (seed + index), so a long render is reproducible. The first backend is the
+    primary one: its output folder is local, segments from the others are
+    downloaded next to it and all of them are joined on this machine.
+    """
+
+    def __init__(self, backends: List[str], base_output_dir: str, segment_frames: int = 73,
+                 overlap_frames: int = 0, min_segment_frames: int = 1):
+        self.backends = backends
+        self.base_output_dir = base_output_dir
+        self.segment_frames = segment_frames
+        self.overlap_frames = overlap_frames
+        self.min_segment_frames = min_segment_frames
+
+    def plan(self, total_frames: int, segment_frames: Optional[int] = None) -> List[Dict[str, int]]:
+        return plan_segments(total_frames, segment_frames or self.segment_frames, self.overlap_frames,
+                             self.min_segment_frames)
+
+    def parallelism(self, plan: List[Dict[str, int]]) -> int:
+        """How many segments can render at the same time"""
+        return max(min(len(self.backends), len(plan)), 1)
+
+    async def _fetch_output(self, client: AsyncHunyuanVideoClient, outputs: Dict[str, Any]) -> str:
+        """Local path of a segment; copied from the backend via /view when it is not on this disk"""
+        for output in outputs.values():
+            for item in output.get("gifs", []):
+                if not item.get("filename", "").endswith(".mp4"):
+                    continue
+                path = os.path.join(self.base_output_dir, item.get("subfolder", ""), item["filename"])
+                if os.path.exists(path):
+                    return path
+                session = await client._get_session()
+                params = {"filename": item["filename"], "subfolder": item.get("subfolder", ""), "type": "output"}
+                async with session.get(f"{client.server_url}/view", params=params) as response:
+                    if response.status != 200:
+                        raise Exception(f"Failed to download segment from {client.server_url}: {response.status}")
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path + ".part", "wb") as f:
+                        async for chunk in response.content.iter_chunked(1024 * 1024):
+                            f.write(chunk)
+                os.replace(path + ".part", path)
+                return path
+        raise Exception(f"Backend {client.server_url} reported no video output")
+
+    async def _render_segment(self, client: AsyncHunyuanVideoClient, index: int, segment: Dict[str, int],
+                              params: Dict[str, Any], base_filename: str, job_id: Optional[str],
+                              cancel_token: Optional[CancelToken]) -> str:
+        token = cancel_token.child(f"segment{index}") if cancel_token is not None else None
+        with tracer.span(job_id, f"segment {index}", server=client.server_url, frames=segment["length"]):
+            workflow = client._create_workflow(
+                params["prompt"], params["folder_name"], f"{base_filename}_seg{index:02d}",
+                params["seed"] + index, segment["length"], params["width"], params["height"],
+                params["enable_upscale"]
+            )
+            outputs = await client._run_workflow(workflow, job_id, token)
+            return await self._fetch_output(client, outputs)
+
+    async def _render_segments(self, clients: List[AsyncHunyuanVideoClient], plan: List[Dict[str, int]],
+                               params: Dict[str, Any], base_filename: str, job_id: Optional[str],
+                               cancel_token: Optional[CancelToken]) -> List[str]:
+        pending = list(range(len(plan)))
+        paths: List[Optional[str]] = [None] * len(plan)
+
+        async def worker(client: AsyncHunyuanVideoClient):
+            # 백엔드마다 하나씩 돌면서 남은 구간을 가져감 (빠른 GPU 가 더 많이 처리)
+            while pending:
+                index = pending.pop(0)
+                try:
+                    paths[index] = await self._render_segment(client, index, plan[index], params,
+                                                              base_filename, job_id, cancel_token)
+                except aiohttp.ClientConnectionError as e:
+                    # 연결할 수 없는 백엔드는 빼고 다른 백엔드가 이 구간을 다시 렌더링
+                    print(f"Backend {client.server_url} unavailable, requeueing segment {index}: {str(e)}")
+                    pending.insert(0, index)
+                    return
+
+        tasks = [asyncio.create_task(worker(client)) for client in clients]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            if cancel_token is not None:
+                # 한 구간이 실패하거나 마감을 넘기면 나머지 백엔드의 구간도 취소
+                overdue = cancel_token.deadline is not None and time.time() >= cancel_token.deadline
+                await asyncio.to_thread(cancel_token.cancel, DEADLINE_EXCEEDED if overdue else "segment failed")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        if pending:
+            raise Exception("No ComfyUI backend was reachable for the remaining segments")
+        return paths
+
+    def _join_command(self, paths: List[str], plan: List[Dict[str, int]], output_path: str) -> List[str]:
+        """
+        ffmpeg filter graph over the segment files: each pair is cross-faded (xfade) over
+        the overlap, and the result is encoded once and cut at exactly total_frames.
+        Only this process decodes the segments, so no backend has to hold the whole clip.
+        """
+        fps = AsyncHunyuanVideoClient.FRAME_RATE
+        total_frames = plan[-1]["start"] + plan[-1]["keep"]
+        command = [_ffmpeg_exe(), "-y", "-loglevel", "error", "-nostdin"]
+        for path in paths:
+            command += ["-i", path]
+
+        # xfade 는 입력의 타임베이스가 같아야 하므로 프레임 레이트와 타임스탬프를 맞춤
+        filters = [f"[{index}:v]settb=AVTB,setpts=PTS-STARTPTS,fps={fps}[s{index}]" for index in range(len(paths))]
+        if self.overlap_frames == 0 or len(paths) == 1:
+            filters.append("".join(f"[s{index}]" for index in range(len(paths))) + f"concat=n={len(paths)}:v=1:a=0[v]")
+        else:
+            previous = "s0"
+            for index in range(1, len(paths)):
+                label = "v" if index == len(paths) - 1 else f"x{index}"
+                filters.append(
+                    f"[{previous}][s{index}]xfade=transition=fade:duration={self.overlap_frames / fps:.6f}"
+                    f":offset={plan[index]['start'] / fps:.6f}[{label}]"
+                )
+                previous = label
+
+        return command + ["-filter_complex", ";".join(filters), "-map", "[v]", "-frames:v", str(total_frames),
+                          "-c:v", "libx264", "-preset", "fast", "-crf", "18", "-pix_fmt", "yuv420p", output_path]
+
+    async def _join(self, paths: List[str], plan: List[Dict[str, int]], output_path: str,
+                    cancel_token: Optional[CancelToken]):
+        partial_path = output_path + ".part.mp4"
+        process = await asyncio.create_subprocess_exec(
+            *self._join_command(paths, plan, partial_path),
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        communicate = asyncio.ensure_future(process.communicate())
+        try:
+            while not communicate.done():
+                await asyncio.wait({communicate}, timeout=1.0)
+                if cancel_token is not None and cancel_token.is_due():
+                    await asyncio.to_thread(cancel_token.check)
+            _, stderr = communicate.result()
+            if process.returncode != 0:
+                raise Exception(f"ffmpeg failed to join segments: {stderr.decode(errors='replace').strip()}")
+            os.replace(partial_path, output_path)
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await communicate
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+
+    async def render(self, prompt: str, total_frames: int, seed: int, width: int = 848, height: int = 480,
+                     enable_upscale: bool = False, folder_name: str = "KTaivle", base_filename: str = "long",
+                     segment_frames: Optional[int] = None, job_id: Optional[str] = None,
+                     cancel_token: Optional[CancelToken] = None) -> str:
+        """Render the segments and join them; returns the path of the joined file"""
+        plan = self.plan(total_frames, segment_frames)
+        params = {"prompt": prompt, "seed": seed, "width": width, "height": height,
+                  "enable_upscale": enable_upscale, "folder_name": folder_name}
+        base_filename = f"{base_filename}_{(job_id or str(seed))[:8]}"
+        clients = [AsyncHunyuanVideoClient(server_url=backend, base_output_dir=self.base_output_dir)
+                   for backend in self.backends]
+        primary = clients[0]
+
+        try:
+            with tracer.span(job_id, "validate_workflow"):
+                # 구간 워크플로에 필요한 노드/모델이 없는 백엔드는 이번 렌더에서 제외
+                sample = primary._create_workflow(prompt, folder_name, base_filename, seed, plan[0]["length"],
+                                                  width, height, enable_upscale)
+                usable = await asyncio.to_thread(schema_cache.compatible, self.backends, sample)
+                if not usable:
+                    await asyncio.to_thread(schema_cache.check, primary.server_url, sample)
+            segment_clients = [client for client in clients if client.server_url in usable]
+            print(f"Rendering {total_frames} frames as {len(plan)} segments on {len(segment_clients)} backends")
+
+            with tracer.span(job_id, "render_segments", segments=len(plan), backends=len(segment_clients)):
+                segment_paths = await self._render_segments(segment_clients, plan, params, base_filename,
+                                                            job_id, cancel_token)
+
+            if len(plan) == 1 and plan[0]["length"] == plan[0]["keep"]:
+                # 잘라낼 프레임이 없는 한 구간이면 이어붙일 필요 없음
+                return segment_paths[0]
+
+            video_path = os.path.join(self.base_output_dir, folder_name, f"{base_filename}.mp4")
+            with tracer.span(job_id, "join_segments", segments=len(plan)):
+                await self._join(segment_paths, plan, video_path, cancel_token)
+
+            # 이어붙인 뒤에는 구간 파일이 필요 없음
+            for path in segment_paths:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error removing segment {path}: {str(e)}")
+
+            print(f"Generated long video path: {video_path}")
+            return video_path
+        finally:
+            for client in clients:
+                await client.close()
\ No newline at end of file
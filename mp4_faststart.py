@@ -0,0 +1,581 @@
+"""
+Pure-Python MP4 box rewriter for progressive web playback.
+
+VHS_VideoCombine may leave the 'moov' atom at the end of the file, so a
+browser has to download the whole video before it can start playing.
+This module rewrites files without re-encoding:
+
+- fast-start: moves 'moov' in front of 'mdat' and shifts the chunk offsets
+  (stco/co64) accordingly;
+- fragmented: rebuilds the file as moov(mvex) + moof/mdat fragments cut at
+  keyframes, which also plays progressively through Media Source Extensions.
+
+Every rewrite goes to a temporary file, is verified, and only then replaces
+the original.
+"""
+import copy
+import os
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Optional, Dict, Tuple, BinaryIO
+
+from tracing import tracer
+
+# 하위 박스를 가진 컨테이너 중 다시 써야 하는 경로에 있는 것만 파싱
+CONTAINER_TYPES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"mvex", b"moof", b"traf"}
+
+# 조각화 시 moov 에서 제거하는 샘플 단위 테이블
+_SAMPLE_TABLES = {b"stts", b"stsc", b"stsz", b"stz2", b"stco", b"co64", b"stss", b"ctts",
+                  b"sdtp", b"sbgp", b"stsh", b"stps"}
+
+_COPY_CHUNK = 1024 * 1024
+_UINT32_MAX = 0xFFFFFFFF
+
+# trun 샘플 플래그
+_SYNC_SAMPLE_FLAGS = 0x02000000
+_NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+
+class Mp4Error(Exception):
+    pass
+
+
+class Box:
+    """An MP4 box: leaf boxes keep their raw payload, containers keep children"""
+
+    def __init__(self, box_type: bytes, payload: bytes = b"", children: Optional[List["Box"]] = None):
+        self.type = box_type
+        self.payload = payload
+        self.children = children
+
+    def find(self, box_type: bytes) -> Optional["Box"]:
+        for child in self.children or []:
+            if child.type == box_type:
+                return child
+        return None
+
+    def find_all(self, box_type: bytes) -> List["Box"]:
+        return [child for child in self.children or [] if child.type == box_type]
+
+    def to_bytes(self) -> bytes:
+        body = self.payload if self.children is None else b"".join(c.to_bytes() for c in self.children)
+        if len(body) + 8 > _UINT32_MAX:
+            return struct.pack(">I4sQ", 1, self.type, len(body) + 16) + body
+        return struct.pack(">I4s", len(body) + 8, self.type) + body
+
+
+def _full_box(box_type: bytes, version: int, flags: int, body: bytes) -> Box:
+    return Box(box_type, struct.pack(">I", (version << 24) | flags) + body)
+
+
+def _version(box: Box) -> int:
+    return box.payload[0]
+
+
+def parse_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> List[Box]:
+    end = len(data) if end is None else end
+    boxes = []
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack(">I4s", data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise Mp4Error(f"Invalid box size for {box_type!r} at {pos}")
+        if box_type in CONTAINER_TYPES:
+            boxes.append(Box(box_type, children=parse_boxes(data, pos + header, pos + size)))
+        else:
+            boxes.append(Box(box_type, data[pos + header:pos + size]))
+        pos += size
+    return boxes
+
+
+def scan_top_level(f: BinaryIO) -> List[Tuple[bytes, int, int, int]]:
+    """(type, offset, size, header_size) of each top-level box, without reading payloads"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    boxes = []
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header or pos + size > file_size:
+            raise Mp4Error(f"Invalid top-level box size for {box_type!r} at {pos}")
+        boxes.append((box_type, pos, size, header))
+        pos += size
+    return boxes
+
+
+def _read_box(f: BinaryIO, entry: Tuple[bytes, int, int, int]) -> Box:
+    box_type, offset, size, _ = entry
+    f.seek(offset)
+    return parse_boxes(f.read(size))[0]
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, offset: int, size: int):
+    src.seek(offset)
+    while size > 0:
+        chunk = src.read(min(_COPY_CHUNK, size))
+        if not chunk:
+            raise Mp4Error("Unexpected end of file while copying")
+        dst.write(chunk)
+        size -= len(chunk)
+
+
+def _tracks(moov: Box) -> List[Box]:
+    return moov.find_all(b"trak")
+
+
+def _stbl(trak: Box) -> Box:
+    try:
+        return trak.find(b"mdia").find(b"minf").find(b"stbl")
+    except AttributeError:
+        raise Mp4Error("Track without a sample table")
+
+
+def _track_id(trak: Box) -> int:
+    tkhd = trak.find(b"tkhd")
+    pos = 20 if _version(tkhd) == 1 else 12
+    return struct.unpack(">I", tkhd.payload[pos:pos + 4])[0]
+
+
+def _timescale(box: Box) -> int:
+    """Timescale of an mvhd or mdhd box"""
+    pos = 20 if _version(box) == 1 else 12
+    return struct.unpack(">I", box.payload[pos:pos + 4])[0]
+
+
+def _movie_duration(mvhd: Box) -> int:
+    if _version(mvhd) == 1:
+        return struct.unpack(">Q", mvhd.payload[24:32])[0]
+    return struct.unpack(">I", mvhd.payload[16:20])[0]
+
+
+def _handler(trak: Box) -> bytes:
+    hdlr = trak.find(b"mdia").find(b"hdlr")
+    return hdlr.payload[8:12] if hdlr is not None else b""
+
+
+def _table(box: Optional[Box], fmt: str) -> List[tuple]:
+    if box is None:
+        return []
+    count = struct.unpack(">I", box.payload[4:8])[0]
+    entry_size = struct.calcsize(fmt)
+    return [struct.unpack(fmt, box.payload[8 + i * entry_size:8 + (i + 1) * entry_size]) for i in range(count)]
+
+
+def _chunk_offsets(stbl: Box) -> List[int]:
+    stco = stbl.find(b"stco")
+    if stco is not None:
+        return [e[0] for e in _table(stco, ">I")]
+    co64 = stbl.find(b"co64")
+    if co64 is not None:
+        return [e[0] for e in _table(co64, ">Q")]
+    raise Mp4Error("Track without chunk offsets")
+
+
+def _set_chunk_offsets(stbl: Box, offsets: List[int]):
+    """Replace stco/co64, upgrading to co64 when an offset no longer fits in 32 bits"""
+    use_co64 = max(offsets, default=0) > _UINT32_MAX
+    box_type, fmt = (b"co64", ">Q") if use_co64 else (b"stco", ">I")
+    new_box = _full_box(box_type, 0, 0, struct.pack(">I", len(offsets)) +
+                        b"".join(struct.pack(fmt, o) for o in offsets))
+    stbl.children = [new_box if c.type in (b"stco", b"co64") else c for c in stbl.children]
+
+
+def _sample_sizes(stbl: Box) -> List[int]:
+    stsz = stbl.find(b"stsz")
+    if stsz is None:
+        raise Mp4Error("Track without stsz (stz2 is not supported)")
+    sample_size, count = struct.unpack(">II", stsz.payload[4:12])
+    if sample_size != 0:
+        return [sample_size] * count
+    return list(struct.unpack(f">{count}I", stsz.payload[12:12 + 4 * count]))
+
+
+def _chunk_layout(stbl: Box) -> List[Tuple[int, int]]:
+    """(file offset, sample count) for every chunk"""
+    offsets = _chunk_offsets(stbl)
+    stsc = _table(stbl.find(b"stsc"), ">III")
+    layout = []
+    for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+        last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            layout.append((offsets[chunk - 1], samples_per_chunk))
+    return layout
+
+
+def _samples(trak: Box) -> List[Dict[str, int]]:
+    """Per-sample offset, size, duration, composition offset and sync flag"""
+    stbl = _stbl(trak)
+    sizes = _sample_sizes(stbl)
+
+    offsets = []
+    for chunk_offset, count in _chunk_layout(stbl):
+        pos = chunk_offset
+        for _ in range(count):
+            if len(offsets) >= len(sizes):
+                break
+            offsets.append(pos)
+            pos += sizes[len(offsets) - 1]
+    if len(offsets) != len(sizes):
+        raise Mp4Error("Sample tables are inconsistent")
+
+    durations = [delta for count, delta in _table(stbl.find(b"stts"), ">II") for _ in range(count)]
+    ctts = stbl.find(b"ctts")
+    cto_fmt = ">Ii" if ctts is not None and _version(ctts) == 1 else ">II"
+    ctos = [offset for count, offset in _table(ctts, cto_fmt) for _ in range(count)]
+    stss = stbl.find(b"stss")
+    sync = set(e[0] for e in _table(stss, ">I")) if stss is not None else None
+
+    samples = []
+    decode_time = 0
+    for i, size in enumerate(sizes):
+        duration = durations[i] if i < len(durations) else (durations[-1] if durations else 0)
+        samples.append({
+            "offset": offsets[i],
+            "size": size,
+            "duration": duration,
+            "cto": ctos[i] if i < len(ctos) else 0,
+            "sync": sync is None or (i + 1) in sync,
+            "decode_time": decode_time,
+        })
+        decode_time += duration
+    return samples
+
+
+def _load(path: str) -> Tuple[List[Tuple[bytes, int, int, int]], Box]:
+    with open(path, "rb") as f:
+        entries = scan_top_level(f)
+        moov_entries = [e for e in entries if e[0] == b"moov"]
+        if not moov_entries:
+            raise Mp4Error("No moov box found")
+        return entries, _read_box(f, moov_entries[0])
+
+
+def is_fast_start(path: str) -> bool:
+    """True when moov comes before any media data"""
+    with open(path, "rb") as f:
+        types = [e[0] for e in scan_top_level(f)]
+    if b"moov" not in types:
+        return False
+    media = [i for i, t in enumerate(types) if t in (b"mdat", b"moof")]
+    return not media or types.index(b"moov") < media[0]
+
+
+def verify(path: str) -> Dict[int, int]:
+    """
+    Check that a file is playable progressively: moov before the media data,
+    and every chunk/run points inside an mdat payload.
+    Returns samples per track_id; raises Mp4Error otherwise.
+    """
+    if not is_fast_start(path):
+        raise Mp4Error("moov is not in front of the media data")
+
+    entries, moov = _load(path)
+    mdat_ranges = [(offset + header, offset + size) for t, offset, size, header in entries if t == b"mdat"]
+
+    def inside_mdat(start: int, length: int) -> bool:
+        return any(lo <= start and start + length <= hi for lo, hi in mdat_ranges)
+
+    counts = {}
+    if moov.find(b"mvex") is None:
+        for trak in _tracks(moov):
+            samples = _samples(trak)
+            for s in samples:
+                if not inside_mdat(s["offset"], s["size"]):
+                    raise Mp4Error(f"Sample at {s['offset']} lies outside mdat")
+            counts[_track_id(trak)] = len(samples)
+        return counts
+
+    for trak in _tracks(moov):
+        counts[_track_id(trak)] = 0
+    with open(path, "rb") as f:
+        for i, entry in enumerate(entries):
+            if entry[0] != b"moof":
+                continue
+            if i + 1 >= len(entries) or entries[i + 1][0] != b"mdat":
+                raise Mp4Error("moof is not followed by mdat")
+            moof_offset = entry[1]
+            moof = _read_box(f, entry)
+            for traf in moof.find_all(b"traf"):
+                track_id = struct.unpack(">I", traf.find(b"tfhd").payload[4:8])[0]
+                for trun in traf.find_all(b"trun"):
+                    count, data_offset, sizes = _parse_trun(trun)
+                    if not inside_mdat(moof_offset + data_offset, sum(sizes)):
+                        raise Mp4Error("trun data lies outside the following mdat")
+                    counts[track_id] = counts.get(track_id, 0) + count
+    return counts
+
+
+def _parse_trun(trun: Box) -> Tuple[int, int, List[int]]:
+    flags = struct.unpack(">I", trun.payload[0:4])[0] & 0xFFFFFF
+    count = struct.unpack(">I", trun.payload[4:8])[0]
+    pos = 8
+    data_offset = 0
+    if flags & 0x1:
+        data_offset = struct.unpack(">i", trun.payload[pos:pos + 4])[0]
+        pos += 4
+    if flags & 0x4:
+        pos += 4
+    field_count = sum(1 for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit)
+    sizes = []
+    for i in range(count):
+        entry = trun.payload[pos + i * 4 * field_count:pos + (i + 1) * 4 * field_count]
+        if flags & 0x200:
+            index = 1 if flags & 0x100 else 0
+            sizes.append(struct.unpack(">I", entry[index * 4:index * 4 + 4])[0])
+    return count, data_offset, sizes
+
+
+def make_fast_start(src_path: str, dst_path: str):
+    """Write src as a fast-start file: moov moved in front of the first mdat"""
+    entries, moov = _load(src_path)
+    moov_entry = next(e for e in entries if e[0] == b"moov")
+    first_mdat = next((e for e in entries if e[0] == b"mdat"), None)
+    if first_mdat is None:
+        raise Mp4Error("No mdat box found")
+
+    insert_at = first_mdat[1]
+    moov_start, old_moov_size = moov_entry[1], moov_entry[2]
+    original = {id(trak): _chunk_offsets(_stbl(trak)) for trak in _tracks(moov)}
+
+    # stco -> co64 승격으로 moov 크기가 바뀔 수 있으므로 크기가 안정될 때까지 반복
+    new_moov_size = old_moov_size
+    while True:
+        for trak in _tracks(moov):
+            shifted = []
+            for offset in original[id(trak)]:
+                if insert_at <= offset < moov_start:
+                    offset += new_moov_size
+                elif offset >= moov_start + old_moov_size:
+                    offset += new_moov_size - old_moov_size
+                shifted.append(offset)
+            _set_chunk_offsets(_stbl(trak), shifted)
+        moov_bytes = moov.to_bytes()
+        if len(moov_bytes) == new_moov_size:
+            break
+        new_moov_size = len(moov_bytes)
+
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for box_type, offset, size, _ in entries:
+            if offset == insert_at:
+                dst.write(moov_bytes)
+            if box_type != b"moov":
+                _copy_range(src, dst, offset, size)
+
+
+def _build_moof(sequence: int, runs: List[Tuple[int, List[Dict[str, int]], int]], data_offsets: List[int]) -> bytes:
+    trafs = []
+    for (track_id, samples, base_time), data_offset in zip(runs, data_offsets):
+        has_cto = any(s["cto"] for s in samples)
+        signed_cto = any(s["cto"] < 0 for s in samples)
+        flags = 0x1 | 0x100 | 0x200 | 0x400 | (0x800 if has_cto else 0)
+        body = struct.pack(">Ii", len(samples), data_offset)
+        for s in samples:
+            body += struct.pack(">III", s["duration"], s["size"],
+                                _SYNC_SAMPLE_FLAGS if s["sync"] else _NON_SYNC_SAMPLE_FLAGS)
+            if has_cto:
+                body += struct.pack(">i" if signed_cto else ">I", s["cto"])
+        trafs.append(Box(b"traf", children=[
+            _full_box(b"tfhd", 0, 0x020000, struct.pack(">I", track_id)),  # default-base-is-moof
+            _full_box(b"tfdt", 1, 0, struct.pack(">Q", base_time)),
+            _full_box(b"trun", 1 if signed_cto else 0, flags, body),
+        ]))
+    return Box(b"moof", children=[_full_box(b"mfhd", 0, 0, struct.pack(">I", sequence))] + trafs).to_bytes()
+
+
+def make_fragmented(src_path: str, dst_path: str, fragment_duration: float = 1.0):
+    """Write src as a fragmented MP4 with one moof/mdat pair per ~fragment_duration seconds"""
+    entries, moov = _load(src_path)
+
+    tracks = []
+    for trak in _tracks(moov):
+        tracks.append({
+            "id": _track_id(trak),
+            "timescale": _timescale(trak.find(b"mdia").find(b"mdhd")),
+            "samples": _samples(trak),
+            "video": _handler(trak) == b"vide",
+        })
+    if not tracks:
+        raise Mp4Error("No tracks found")
+
+    # 기준 트랙(비디오)의 키프레임에서만 조각을 나눔
+    ref = next((t for t in tracks if t["video"]), tracks[0])
+    boundaries = [0]
+    for s in ref["samples"]:
+        if s["sync"] and s["decode_time"] - boundaries[-1] >= fragment_duration * ref["timescale"]:
+            boundaries.append(s["decode_time"])
+
+    def fragment_index(track: Dict, sample: Dict[str, int]) -> int:
+        index = 0
+        for i, boundary in enumerate(boundaries):
+            # sample_time / track_ts >= boundary / ref_ts 를 정수로 비교
+            if sample["decode_time"] * ref["timescale"] >= boundary * track["timescale"]:
+                index = i
+        return index
+
+    fragments = [[] for _ in boundaries]
+    for track in tracks:
+        per_fragment = [[] for _ in boundaries]
+        for sample in track["samples"]:
+            per_fragment[fragment_index(track, sample)].append(sample)
+        for i, samples in enumerate(per_fragment):
+            if samples:
+                fragments[i].append((track["id"], samples, samples[0]["decode_time"]))
+
+    # moov: 샘플 테이블을 비우고 mvex 추가
+    new_moov = copy.deepcopy(moov)
+    for trak in _tracks(new_moov):
+        stbl = _stbl(trak)
+        children = [c for c in stbl.children if c.type not in _SAMPLE_TABLES]
+        children += [
+            _full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+            _full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+            _full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+            _full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+        ]
+        stbl.children = children
+    mvhd = new_moov.find(b"mvhd")
+    duration = _movie_duration(mvhd)
+    mehd = (_full_box(b"mehd", 1, 0, struct.pack(">Q", duration)) if duration > _UINT32_MAX
+            else _full_box(b"mehd", 0, 0, struct.pack(">I", duration)))
+    trexs = [_full_box(b"trex", 0, 0, struct.pack(">IIIII", t["id"], 1, 0, 0, 0)) for t in tracks]
+    new_moov.children = [c for c in new_moov.children if c.type != b"mvex"]
+    new_moov.children.append(Box(b"mvex", children=[mehd] + trexs))
+
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for box_type, offset, size, _ in entries:
+            if box_type not in (b"moov", b"mdat", b"free", b"skip", b"wide"):
+                _copy_range(src, dst, offset, size)
+        dst.write(new_moov.to_bytes())
+
+        sequence = 1
+        for runs in fragments:
+            if not runs:
+                continue
+            run_sizes = [sum(s["size"] for s in samples) for _, samples, _ in runs]
+            moof_size = len(_build_moof(sequence, runs, [0] * len(runs)))
+            data_offsets = []
+            pos = moof_size + 8
+            for run_size in run_sizes:
+                data_offsets.append(pos)
+                pos += run_size
+            dst.write(_build_moof(sequence, runs, data_offsets))
+            dst.write(struct.pack(">I4s", 8 + sum(run_sizes), b"mdat"))
+            for _, samples, _ in runs:
+                for s in samples:
+                    _copy_range(src, dst, s["offset"], s["size"])
+            sequence += 1
+
+
+def _replace(src: str, dst: str, attempts: int = 10, delay: float = 1.0):
+    # Windows 에서는 다른 요청이 파일을 읽는 중이면 교체가 실패하므로 재시도
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+
+
+def sample_counts(path: str) -> Dict[int, int]:
+    """Samples per track_id of a non-fragmented file, wherever its moov is"""
+    _, moov = _load(path)
+    if moov.find(b"mvex") is not None:
+        return verify(path)
+    return {_track_id(trak): len(_sample_sizes(_stbl(trak))) for trak in _tracks(moov)}
+
+
+def optimize_in_place(path: str, fragmented: bool = False, fragment_duration: float = 1.0) -> bool:
+    """
+    Rewrite an MP4 for progressive playback and replace it atomically after
+    verification. Returns False when the file was already fast-start.
+    """
+    if not fragmented and is_fast_start(path):
+        return False
+
+    expected = sample_counts(path)
+    fd, tmp_path = tempfile.mkstemp(suffix=".mp4.tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        if fragmented:
+            make_fragmented(path, tmp_path, fragment_duration)
+        else:
+            make_fast_start(path, tmp_path)
+        actual = verify(tmp_path)
+        if actual != expected:
+            raise Mp4Error(f"Sample counts changed: {expected} -> {actual}")
+        _replace(tmp_path, path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class Mp4PostProcessor:
+    """
+    Runs optimize_in_place on a background thread, off the request path.
+    Rewrites are tracked by path until they finish, so serve_file can hold a
+    download of that file until the rewritten layout is in place.
+    """
+
+    def __init__(self, fragmented: bool = False, fragment_duration: float = 1.0, max_workers: int = 1):
+        self.fragmented = fragmented
+        self.fragment_duration = fragment_duration
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mp4-post")
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def _run(self, path: str, job_id: Optional[str]) -> bool:
+        try:
+            with tracer.span(job_id, "mp4_postprocess", fragmented=self.fragmented):
+                changed = optimize_in_place(path, self.fragmented, self.fragment_duration)
+            if changed:
+                print(f"Rewrote {path} for progressive playback")
+            return changed
+        except Exception as e:
+            print(f"Error post-processing {path}: {str(e)}")
+            return False
+
+    def _forget(self, key: str, future: Future):
+        with self._lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def submit(self, path: str, job_id: Optional[str] = None) -> Future:
+        key = self._key(path)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._run, path, job_id)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def wait(self, path: str):
+        """Block until a pending rewrite of path has replaced the file (no-op if none is pending)"""
+        with self._lock:
+            future = self._pending.get(self._key(path))
+        if future is not None:
+            # _run 은 예외를 삼키므로 실패한 경우에도 원본 파일 그대로 제공됨
+            future.result()
\ No newline at end of file
@@ -90,18 +90,7 @@ The prompt should be optimized for AI video generation and maintain consistency
             processed_prompt = self._prepare_prompt(prompt_data)
             
             # 새로운 OpenAI API 버전으로 호출
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": processed_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=1000,
-                top_p=0.9,
-                frequency_penalty=0.3,
-                presence_penalty=0.3
-            )
+            response = self.client.chat.completions.create(**self._completion_kwargs(processed_prompt))
             
             # 새로운 응답 구조에 맞게 수정
             generated_prompt = response.choices[0].message.content.strip()
@@ -115,6 +104,21 @@ The prompt should be optimized for AI video generation and maintain consistency
             print(f"Error generating prompt: {str(e)}")
             raise
 
+    def _completion_kwargs(self, processed_prompt: str) -> Dict:
+        """chat.completions.create 호출 인자 구성 (동기/비동기 클라이언트 공용)"""
+        return {
+            "model": "gpt-4",
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": processed_prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "top_p": 0.9,
+            "frequency_penalty": 0.3,
+            "presence_penalty": 0.3
+        }
+
     def _log_generation(self, input_prompt: str, generated_prompt: str):
         """프롬프트 생성 로그를 기록"""
         try:
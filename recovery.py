@@ -0,0 +1,139 @@
+import threading
+import time
+from typing import Dict, Any, Optional, List, Callable
+
+import requests
+
+from job_store import JobStore, STATUS_COMPLETED, STATUS_FAILED
+
+# 작업 종류별 결과 파일 확장자
+_EXTENSIONS = {
+    "video": ".mp4",
+    "examples": ".png",
+    "refine": ".png",
+}
+
+
+def output_files(outputs: Dict[str, Any], extension: Optional[str] = None) -> List[str]:
+    """Relative paths (subfolder/filename) of saved files listed in ComfyUI outputs"""
+    paths = []
+    for output in outputs.values():
+        # SaveImage 는 images, VHS_VideoCombine 은 gifs 로 결과를 알려줌
+        for item in output.get("images", []) + output.get("gifs", []):
+            filename = item.get("filename", "")
+            if item.get("type", "output") != "output":
+                continue
+            if extension is not None and not filename.endswith(extension):
+                continue
+            subfolder = item.get("subfolder", "")
+            paths.append(f"{subfolder}/{filename}" if subfolder else filename)
+    return paths
+
+
+class JobRecovery:
+    """
+    Reconciles unfinished jobs from the JobStore against their ComfyUI backend
+    after a restart: finished prompts have their outputs collected from /history,
+    prompts still in /queue are watched until they finish, and anything the
+    backend no longer knows about is marked failed. Nothing is re-rendered.
+    """
+
+    def __init__(self, store: JobStore, poll_interval: float = 5.0, max_wait: float = 6 * 3600,
+                 on_completed: Optional[Callable[[Dict[str, Any], List[str]], None]] = None):
+        self.store = store
+        self.on_completed = on_completed
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+
+    def _history_entry(self, prompt: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        response = requests.get(f"{prompt['backend']}/history/{prompt['prompt_id']}", timeout=10)
+        response.raise_for_status()
+        return response.json().get(prompt["prompt_id"])
+
+    def _in_queue(self, prompt: Dict[str, Any]) -> bool:
+        queue = requests.get(f"{prompt['backend']}/queue", timeout=10).json()
+        items = queue.get("queue_running", []) + queue.get("queue_pending", [])
+        return any(item[1] == prompt["prompt_id"] for item in items)
+
+    def _prompts(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # job_prompts 테이블이 생기기 전에 기록된 작업은 jobs.prompt_id 하나만 있음
+        if job.get("prompts"):
+            return job["prompts"]
+        if job["prompt_id"]:
+            return [{"backend": job["backend"], "prompt_id": job["prompt_id"]}]
+        return []
+
+    def _collect(self, job: Dict[str, Any], entries: List[Dict[str, Any]]):
+        outputs = []
+        for entry in entries:
+            status = entry.get("status") or {}
+            if status.get("status_str") == "error":
+                self.store.finish(job["job_id"], STATUS_FAILED, error="ComfyUI reported an execution error")
+                return
+            # 프롬프트 순서대로 이어붙여 이미지 순서 (refine seed = seed + index) 를 유지
+            outputs.extend(output_files(entry.get("outputs") or {}, _EXTENSIONS.get(job["kind"])))
+        self.store.finish(job["job_id"], STATUS_COMPLETED, outputs)
+        print(f"Recovered job {job['job_id']}: {outputs}")
+        if self.on_completed is not None:
+            self.on_completed(job, outputs)
+
+    def _check(self, job: Dict[str, Any]) -> bool:
+        """Returns True once the job reached a final state (every prompt finished, or one is lost)"""
+        entries = []
+        for prompt in self._prompts(job):
+            entry = self._history_entry(prompt)
+            if entry is None:
+                if self._in_queue(prompt):
+                    return False
+                # 두 요청 사이에 끝났을 수 있으므로 history 를 한 번 더 확인
+                entry = self._history_entry(prompt)
+                if entry is None:
+                    self.store.finish(job["job_id"], STATUS_FAILED, error="Prompt is no longer known to the backend")
+                    return True
+            entries.append(entry)
+        self._collect(job, entries)
+        return True
+
+    def _watch(self, job: Dict[str, Any]):
+        started = time.time()
+        while time.time() - started < self.max_wait:
+            try:
+                if self._check(job):
+                    return
+            except requests.RequestException as e:
+                print(f"Error checking job {job['job_id']}: {str(e)}")
+            time.sleep(self.poll_interval)
+        self.store.finish(job["job_id"], STATUS_FAILED, error="Gave up waiting for the backend")
+
+    def reconcile(self) -> List[threading.Thread]:
+        """Resolve every unfinished job; returns the watcher threads started for running ones"""
+        watchers = []
+        for job in self.store.unfinished():
+            if job["kind"] == "long_video":
+                # 구간 렌더와 이어붙이기는 요청 안에서만 진행되므로 재시작 후 이어갈 수 없음
+                self.store.finish(job["job_id"], STATUS_FAILED,
+                                  error="Segmented render was interrupted by a restart")
+                continue
+            prompts = self._prompts(job)
+            if not prompts:
+                self.store.finish(job["job_id"], STATUS_FAILED,
+                                  error="Service restarted before the job was submitted")
+                continue
+            if len(prompts) < job["params"].get("batch_size", 1):
+                # 예시 이미지는 한 장씩 제출되므로 일부만 제출된 작업은 이어서 렌더링할 수 없음
+                self.store.finish(job["job_id"], STATUS_FAILED,
+                                  error="Service restarted before every image was submitted")
+                continue
+
+            try:
+                if self._check(job):
+                    continue
+            except requests.RequestException as e:
+                print(f"Backend unreachable for job {job['job_id']}: {str(e)}")
+
+            # 아직 실행 중이거나 백엔드에 연결할 수 없으면 완료될 때까지 백그라운드에서 추적
+            print(f"Reattaching to job {job['job_id']} ({len(prompts)} prompts)")
+            watcher = threading.Thread(target=self._watch, args=(job,), daemon=True)
+            watcher.start()
+            watchers.append(watcher)
+        return watchers
\ No newline at end of file
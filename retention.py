@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+from job_store import JobStore
+
+GB = 1024 ** 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_access (
+    path        TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pinned_files (
+    path      TEXT PRIMARY KEY,
+    user_id   TEXT,
+    pinned_at REAL NOT NULL
+);
+"""
+
+
+def _normalize(path: str) -> str:
+    return path.replace("\\", "/").strip("/")
+
+
+class RetentionManager:
+    """
+    Keeps the files this app rendered bounded with per-user, per-folder and total byte quotas.
+    Only outputs of completed jobs in the JobStore are managed; anything else under the
+    ComfyUI output root is never counted or touched. A file belongs to the job's user, or to
+    its top-level output folder when the job had no user id. Files are evicted
+    least-recently-accessed first; access times are recorded by the app (filesystem atime is
+    often disabled) and pinned favorites are never evicted. A background sweeper applies the
+    policy periodically; deleting is opt-in (dry_run=False), otherwise it only reports what
+    it would delete.
+    """
+
+    def __init__(self, base_dir: str, store: JobStore,
+                 folder_quota_bytes: Optional[int] = 50 * GB,
+                 user_quota_bytes: Optional[int] = 20 * GB,
+                 total_quota_bytes: Optional[int] = 500 * GB,
+                 max_files_per_folder: Optional[int] = 2000,
+                 folder_quotas: Optional[Dict[str, int]] = None,
+                 user_quotas: Optional[Dict[str, int]] = None,
+                 min_age_s: float = 3600, dry_run: bool = True):
+        self.base_dir = base_dir
+        self.store = store
+        self.folder_quota_bytes = folder_quota_bytes
+        self.user_quota_bytes = user_quota_bytes
+        self.total_quota_bytes = total_quota_bytes
+        self.max_files_per_folder = max_files_per_folder
+        self.folder_quotas = folder_quotas or {}
+        self.user_quotas = user_quotas or {}
+        # 방금 만들어졌거나 아직 쓰는 중인 파일은 건드리지 않음
+        self.min_age_s = min_age_s
+        self.dry_run = dry_run
+        self.last_report = None
+
+        # 작업 DB 와 같은 SQLite 파일에 접근 기록과 고정 목록을 저장
+        self._conn = sqlite3.connect(store.db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._pending_access: Dict[str, float] = {}
+        self._pending_lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+        with self._lock:
+            self._conn.executescript(_SCHEMA)
+
+    def _execute(self, sql: str, args: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def touch(self, path: str):
+        """Record an access; buffered in memory so serving files does not write to the database"""
+        with self._pending_lock:
+            self._pending_access[_normalize(path)] = time.time()
+
+    def flush(self):
+        with self._pending_lock:
+            pending, self._pending_access = self._pending_access, {}
+        if not pending:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO file_access (path, last_access) VALUES (?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)",
+                list(pending.items())
+            )
+
+    def pin(self, path: str, user_id: Optional[str] = None) -> str:
+        """Returns 'pinned', or 'forbidden' when another user already pinned the file"""
+        path = _normalize(path)
+        with self._lock:
+            row = self._conn.execute("SELECT user_id FROM pinned_files WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[0] != user_id:
+                return "forbidden"
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pinned_files (path, user_id, pinned_at) VALUES (?, ?, ?)",
+                (path, user_id, time.time())
+            )
+        return "pinned"
+
+    def unpin(self, path: str, user_id: Optional[str] = None) -> str:
+        """
+        Only the user who pinned a file can unpin it.
+        Returns 'unpinned', 'not_pinned' or 'forbidden'.
+        """
+        path = _normalize(path)
+        with self._lock:
+            row = self._conn.execute("SELECT user_id FROM pinned_files WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return "not_pinned"
+            if row[0] != user_id:
+                return "forbidden"
+            self._conn.execute("DELETE FROM pinned_files WHERE path = ?", (path,))
+        return "unpinned"
+
+    def pinned(self, user_id: Optional[str] = None) -> List[str]:
+        if user_id is None:
+            rows = self._execute("SELECT path FROM pinned_files ORDER BY pinned_at")
+        else:
+            rows = self._execute("SELECT path FROM pinned_files WHERE user_id = ? ORDER BY pinned_at", (user_id,))
+        return [row[0] for row in rows]
+
+    def _scan(self) -> List[Dict[str, Any]]:
+        """Job output files that still exist, with size, last access, folder, owner and job"""
+        access = dict(self._execute("SELECT path, last_access FROM file_access"))
+        with self._pending_lock:
+            access.update(self._pending_access)
+        pinned = set(self.pinned())
+
+        files = []
+        for path, job in self.store.completed_outputs().items():
+            try:
+                stat = os.stat(os.path.join(self.base_dir, path))
+            except OSError:
+                continue
+            parts = path.split("/")
+            folder = parts[0] if len(parts) > 1 else ""
+            files.append({
+                "path": path,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "last_access": max(stat.st_mtime, access.get(path, 0)),
+                "folder": folder,
+                # 프론트엔드는 userId 대신 사용자별 저장 폴더 (savePath) 만 보내는 경우가 많음
+                "owner": job["user_id"] or folder or None,
+                "job_id": job["job_id"],
+                "pinned": path in pinned,
+            })
+        return files
+
+    def _scopes(self, files: List[Dict[str, Any]]) -> List[tuple]:
+        """(kind, name, byte quota, file quota, files); folders and users first, the total last"""
+        folders: Dict[str, List[Dict[str, Any]]] = {}
+        users: Dict[str, List[Dict[str, Any]]] = {}
+        for f in files:
+            folders.setdefault(f["folder"], []).append(f)
+            if f["owner"] is not None:
+                users.setdefault(f["owner"], []).append(f)
+
+        scopes = []
+        for name, members in folders.items():
+            quota = self.folder_quotas.get(name, self.folder_quota_bytes)
+            scopes.append(("folder", name, quota, self.max_files_per_folder, members))
+        for name, members in users.items():
+            scopes.append(("user", name, self.user_quotas.get(name, self.user_quota_bytes), None, members))
+        scopes.append(("total", None, self.total_quota_bytes, None, files))
+        return scopes
+
+    def sweep(self, dry_run: Optional[bool] = None) -> Dict[str, Any]:
+        """Apply the quotas once; returns a report of evicted (or, in dry-run, evictable) files"""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        self.flush()
+        now = time.time()
+        files = self._scan()
+
+        evicted: Dict[str, Dict[str, Any]] = {}
+        over_quota = []
+        for kind, name, quota, max_files, members in self._scopes(files):
+            live = [f for f in members if f["path"] not in evicted]
+            used = sum(f["size"] for f in live)
+            count = len(live)
+            candidates = sorted(
+                (f for f in live if not f["pinned"] and now - f["mtime"] >= self.min_age_s),
+                key=lambda f: f["last_access"]
+            )
+            for f in candidates:
+                if (quota is None or used <= quota) and (max_files is None or count <= max_files):
+                    break
+                evicted[f["path"]] = dict(f, reason=f"{kind} {name} over quota" if name else f"{kind} over quota")
+                used -= f["size"]
+                count -= 1
+            if (quota is not None and used > quota) or (max_files is not None and count > max_files):
+                # 고정 파일이나 최근 파일만 남아 더 줄일 수 없는 경우
+                over_quota.append({"scope": kind, "name": name, "used_bytes": used,
+                                   "quota_bytes": quota, "files": count})
+
+        deleted = []
+        if not dry_run:
+            for path, f in evicted.items():
+                try:
+                    os.remove(os.path.join(self.base_dir, path))
+                    deleted.append(path)
+                except OSError as e:
+                    print(f"Error evicting {path}: {str(e)}")
+            by_job: Dict[str, List[str]] = {}
+            for path in deleted:
+                self._execute("DELETE FROM file_access WHERE path = ?", (path,))
+                by_job.setdefault(evicted[path]["job_id"], []).append(path)
+            # /jobs/<id> 가 지워진 파일 경로를 돌려주지 않도록 작업 기록에서도 제거
+            for job_id, paths in by_job.items():
+                self.store.mark_evicted(job_id, paths)
+
+        report = {
+            "dry_run": dry_run,
+            "swept_at": now,
+            "scanned_files": len(files),
+            "scanned_bytes": sum(f["size"] for f in files),
+            "evicted": [
+                {"path": f["path"], "size": f["size"], "last_access": f["last_access"], "reason": f["reason"]}
+                for f in evicted.values()
+            ],
+            "evicted_bytes": sum(f["size"] for f in evicted.values()),
+            "failed": [path for path in evicted if not dry_run and path not in deleted],
+            "over_quota": over_quota,
+        }
+        self.last_report = report
+        print(f"Retention sweep ({'dry run' if dry_run else 'applied'}): "
+              f"{len(evicted)} files, {report['evicted_bytes']} bytes")
+        return report
+
+    def _run(self, interval_s: float):
+        while not self._stop.wait(interval_s):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error in retention sweep: {str(e)}")
+
+    def start(self, interval_s: float = 600):
+        """Start the background sweeper (once)"""
+        if self._sweeper is not None:
+            return
+        self._sweeper = threading.Thread(target=self._run, args=(interval_s,), daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stop.set()
\ No newline at end of file
@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Callable
+
+# Chrome trace 포맷에서 사용하는 트랙(tid) 구분
+TRACK_APP = 1
+TRACK_COMFYUI = 2
+
+_TRACK_NAMES = {
+    TRACK_APP: "app",
+    TRACK_COMFYUI: "comfyui",
+}
+
+
+def _now_us() -> int:
+    return time.perf_counter_ns() // 1000
+
+
+class Tracer:
+    """
+    Lightweight per-job span recorder.
+    Traces are kept in a bounded ring buffer (oldest job evicted first) and
+    can be exported in Chrome trace event format for viewing in Perfetto.
+    """
+
+    def __init__(self, max_jobs: int = 200, max_events_per_job: int = 5000):
+        self.max_jobs = max_jobs
+        self.max_events_per_job = max_events_per_job
+        self._traces: "OrderedDict[str, deque]" = OrderedDict()
+        self._open: Dict[tuple, Dict[str, Any]] = {}
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback: Callable[[str, Dict[str, Any]], None]):
+        """Register callback(job_id, event) invoked for every recorded event"""
+        self._listeners.append(callback)
+
+    def _append(self, job_id: str, event: Dict[str, Any]):
+        with self._lock:
+            events = self._traces.get(job_id)
+            if events is None:
+                events = deque(maxlen=self.max_events_per_job)
+                self._traces[job_id] = events
+                while len(self._traces) > self.max_jobs:
+                    evicted, _ = self._traces.popitem(last=False)
+                    for key in [k for k in self._open if k[0] == evicted]:
+                        del self._open[key]
+            else:
+                self._traces.move_to_end(job_id)
+            events.append(event)
+        for callback in self._listeners:
+            try:
+                callback(job_id, event)
+            except Exception as e:
+                print(f"Error in trace listener: {str(e)}")
+
+    def complete(self, job_id: Optional[str], name: str, start_us: int, end_us: int,
+                 category: str = "app", track: int = TRACK_APP, **args):
+        """Record a finished span with explicit start/end timestamps (microseconds)"""
+        if job_id is None:
+            return
+        self._append(job_id, {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_us,
+            "dur": max(end_us - start_us, 0),
+            "tid": track,
+            "args": args,
+        })
+
+    def instant(self, job_id: Optional[str], name: str, category: str = "app",
+                track: int = TRACK_APP, **args):
+        if job_id is None:
+            return
+        self._append(job_id, {
+            "name": name,
+            "cat": category,
+            "ph": "i",
+            "s": "t",
+            "ts": _now_us(),
+            "tid": track,
+            "args": args,
+        })
+
+    @contextmanager
+    def span(self, job_id: Optional[str], name: str, category: str = "app",
+             track: int = TRACK_APP, **args):
+        """Context manager recording the enclosed block as one span"""
+        start = _now_us()
+        try:
+            yield
+        except Exception as e:
+            args["error"] = str(e)
+            raise
+        finally:
+            self.complete(job_id, name, start, _now_us(), category, track, **args)
+
+    def begin(self, job_id: Optional[str], name: str, category: str = "app",
+              track: int = TRACK_APP, **args):
+        """Open a span that is closed later by end() with the same name and track"""
+        if job_id is None:
+            return
+        with self._lock:
+            self._open[(job_id, track, name)] = {"ts": _now_us(), "cat": category, "args": args}
+
+    def end(self, job_id: Optional[str], name: str, track: int = TRACK_APP, **args):
+        if job_id is None:
+            return
+        with self._lock:
+            opened = self._open.pop((job_id, track, name), None)
+        if opened is None:
+            return
+        opened["args"].update(args)
+        self.complete(job_id, name, opened["ts"], _now_us(), opened["cat"], track, **opened["args"])
+
+    def has_trace(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._traces
+
+    def get_events(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._traces.get(job_id, ()))
+
+    def export_chrome_trace(self, job_id: str) -> Dict[str, Any]:
+        """Return the job's events as a Chrome trace event JSON object"""
+        pid = os.getpid()
+        events = [{
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "tid": 0,
+            "args": {"name": f"job {job_id}"},
+        }]
+        for tid, track_name in _TRACK_NAMES.items():
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": track_name},
+            })
+        for event in self.get_events(job_id):
+            events.append(dict(event, pid=pid))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class NodeTimeline:
+    """
+    Turns ComfyUI WebSocket messages into per-node spans.
+    ComfyUI sends an 'executing' message whenever it moves to the next node;
+    the previous node is considered finished at that point.
+    """
+
+    def __init__(self, tracer: Tracer, job_id: Optional[str], queued_at_us: Optional[int] = None):
+        self.tracer = tracer
+        self.job_id = job_id
+        self.queued_at_us = queued_at_us if queued_at_us is not None else _now_us()
+        self.started = False
+        self.current_node = None
+        self.node_started_at_us = None
+
+    def _mark_started(self):
+        if not self.started:
+            self.started = True
+            self.tracer.complete(self.job_id, "queue_wait", self.queued_at_us, _now_us(),
+                                 "comfyui", TRACK_COMFYUI)
+
+    def _close_current(self):
+        if self.current_node is not None:
+            self.tracer.complete(self.job_id, f"node {self.current_node}", self.node_started_at_us,
+                                 _now_us(), "comfyui", TRACK_COMFYUI, node=self.current_node)
+            self.current_node = None
+
+    def on_message(self, msg: Dict[str, Any]):
+        msg_type = msg.get("type")
+        data = msg.get("data") or {}
+
+        if msg_type == "execution_start":
+            self._mark_started()
+        elif msg_type == "execution_cached":
+            self._mark_started()
+            self.tracer.instant(self.job_id, "cached", "comfyui", TRACK_COMFYUI,
+                                nodes=data.get("nodes", []))
+        elif msg_type == "executing":
+            self._mark_started()
+            self._close_current()
+            node = data.get("node")
+            if node is not None:
+                self.current_node = node
+                self.node_started_at_us = _now_us()
+        elif msg_type in ("executed", "execution_error", "execution_interrupted"):
+            if msg_type != "executed":
+                self._close_current()
+            self.tracer.instant(self.job_id, msg_type, "comfyui", TRACK_COMFYUI,
+                                node=data.get("node"))
+
+    def finish(self):
+        self._close_current()
+
+
+tracer = Tracer()
\ No newline at end of file
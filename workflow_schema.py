@@ -0,0 +1,205 @@
+import threading
+import time
+from typing import Dict, Any, Optional, List
+
+import requests
+
+# 업로드 위젯이 있는 입력은 목록이 캐시 이후에 바뀌므로 (방금 올린 파일) 값 검사를 건너뜀
+_UPLOAD_OPTIONS = ("image_upload", "video_upload", "audio_upload")
+
+
+class WorkflowValidationError(Exception):
+    """Raised before submission when a workflow cannot run on a backend"""
+
+    def __init__(self, server_url: str, errors: List[str]):
+        super().__init__(f"Workflow cannot run on {server_url}: " + "; ".join(errors))
+        self.server_url = server_url
+        self.errors = errors
+
+
+def _combo_options(spec: list) -> Optional[list]:
+    """Allowed values of a combo input ([options, {...}] or ["COMBO", {"options": [...]}])"""
+    if not spec:
+        return None
+    extra = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if any(extra.get(key) for key in _UPLOAD_OPTIONS):
+        return None
+    if isinstance(spec[0], list):
+        options = spec[0]
+    elif spec[0] == "COMBO":
+        options = extra.get("options") or []
+    else:
+        return None
+    # 일부 노드는 [이름, {추가 위젯}] 형태의 항목을 씀
+    return [option[0] if isinstance(option, list) else option for option in options]
+
+
+def validate_workflow(workflow: Dict[str, Any], object_info: Dict[str, Any]) -> List[str]:
+    """
+    Check a workflow against a backend's /object_info schema:
+    node classes, links, required inputs, combo values (model files etc.) and numeric ranges.
+    Returns a list of problems; empty when the workflow can be submitted.
+    """
+    errors = []
+    for node_id, node in workflow.items():
+        class_type = node.get("class_type")
+        info = object_info.get(class_type)
+        if info is None:
+            errors.append(f"node {node_id}: class '{class_type}' is not installed")
+            continue
+
+        inputs = node.get("inputs", {})
+        for name, value in inputs.items():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[1], int):
+                if str(value[0]) not in workflow:
+                    errors.append(f"node {node_id}: input '{name}' links to missing node {value[0]}")
+
+        required = (info.get("input") or {}).get("required") or {}
+        optional = (info.get("input") or {}).get("optional") or {}
+        for name, spec in list(required.items()) + list(optional.items()):
+            if name not in inputs:
+                if name in required:
+                    errors.append(f"node {node_id} ({class_type}): missing required input '{name}'")
+                continue
+            value = inputs[name]
+            if isinstance(value, list):
+                continue  # 다른 노드의 출력과 연결된 입력
+
+            options = _combo_options(spec)
+            if options is not None:
+                if value not in options:
+                    errors.append(f"node {node_id} ({class_type}): '{value}' is not available for '{name}'")
+                continue
+
+            extra = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+            if spec[0] in ("INT", "FLOAT") and isinstance(value, (int, float)) and not isinstance(value, bool):
+                if ("min" in extra and value < extra["min"]) or ("max" in extra and value > extra["max"]):
+                    errors.append(f"node {node_id} ({class_type}): {name}={value} is outside "
+                                  f"[{extra.get('min')}, {extra.get('max')}]")
+    return errors
+
+
+class SchemaCache:
+    """
+    /object_info of each ComfyUI backend, fetched once and refreshed in the background,
+    so workflows can be validated locally before they are queued on a GPU.
+    """
+
+    def __init__(self, refresh_interval_s: float = 300, recheck_after_s: float = 30, timeout_s: float = 10,
+                 failure_backoff_s: float = 15):
+        self.refresh_interval_s = refresh_interval_s
+        # 검증에 실패했을 때 캐시가 이보다 오래됐으면 한 번 새로 받아 다시 검사 (방금 설치한 모델 등)
+        self.recheck_after_s = recheck_after_s
+        self.timeout_s = timeout_s
+        # 받아오지 못한 백엔드는 이 시간 (실패할 때마다 두 배, refresh_interval_s 까지) 동안 요청 경로에서 다시 시도하지 않음
+        self.failure_backoff_s = failure_backoff_s
+        self._schemas: Dict[str, Dict[str, Any]] = {}
+        self._fetched_at: Dict[str, float] = {}
+        self._failures: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def _backing_off(self, server_url: str) -> bool:
+        with self._lock:
+            failure = self._failures.get(server_url)
+        return failure is not None and time.time() < failure["retry_at"]
+
+    def refresh(self, server_url: str, force: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the schema again. After a failed fetch, calls without force return the
+        cached schema (or None) until the backoff has passed instead of blocking again.
+        """
+        if not force and self._backing_off(server_url):
+            with self._lock:
+                return self._schemas.get(server_url)
+        try:
+            response = requests.get(f"{server_url}/object_info", timeout=(min(3, self.timeout_s), self.timeout_s))
+            response.raise_for_status()
+            schema = response.json()
+        except (requests.RequestException, ValueError) as e:
+            # 받아오지 못하면 이전 스키마를 계속 사용
+            print(f"Error fetching /object_info from {server_url}: {str(e)}")
+            with self._lock:
+                count = self._failures.get(server_url, {}).get("count", 0) + 1
+                backoff = min(self.failure_backoff_s * 2 ** (count - 1), self.refresh_interval_s)
+                self._failures[server_url] = {"count": count, "failed_at": time.time(),
+                                              "retry_at": time.time() + backoff, "error": str(e)}
+                return self._schemas.get(server_url)
+        with self._lock:
+            self._schemas[server_url] = schema
+            self._fetched_at[server_url] = time.time()
+            self._failures.pop(server_url, None)
+        return schema
+
+    def get(self, server_url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            schema = self._schemas.get(server_url)
+        if schema is None:
+            schema = self.refresh(server_url)
+        return schema
+
+    def errors(self, server_url: str, workflow: Dict[str, Any]) -> Optional[List[str]]:
+        """Validation problems on this backend; None when its schema is unavailable"""
+        schema = self.get(server_url)
+        if not schema:
+            return None
+        errors = validate_workflow(workflow, schema)
+        with self._lock:
+            age = time.time() - self._fetched_at.get(server_url, 0)
+        if errors and age > self.recheck_after_s:
+            schema = self.refresh(server_url)
+            errors = validate_workflow(workflow, schema) if schema else None
+        return errors
+
+    def check(self, server_url: str, workflow: Dict[str, Any]):
+        """Raise WorkflowValidationError if the workflow cannot run on server_url"""
+        errors = self.errors(server_url, workflow)
+        if errors is None:
+            # 스키마를 받을 수 없으면 막지 않고 제출 단계에서 오류가 나게 둠
+            return
+        if errors:
+            raise WorkflowValidationError(server_url, errors)
+
+    def compatible(self, backends: List[str], workflow: Dict[str, Any]) -> List[str]:
+        """Backends this workflow can run on (unknown schemas count as compatible)"""
+        result = []
+        for server_url in backends:
+            errors = self.errors(server_url, workflow)
+            if errors:
+                print(f"Excluding {server_url} for this workflow: {'; '.join(errors)}")
+                continue
+            result.append(server_url)
+        return result
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            result = {
+                server_url: {"fetched_at": self._fetched_at.get(server_url), "node_classes": len(schema)}
+                for server_url, schema in self._schemas.items()
+            }
+            for server_url, failure in self._failures.items():
+                result.setdefault(server_url, {}).update(
+                    last_error=failure["error"], failed_at=failure["failed_at"], retry_at=failure["retry_at"]
+                )
+            return result
+
+    def _run(self, backends: List[str]):
+        while not self._stop.wait(self.refresh_interval_s):
+            for server_url in backends:
+                self.refresh(server_url, force=True)
+
+    def start(self, backends: List[str]):
+        """Fetch every backend's schema now and keep refreshing it in the background"""
+        if self._refresher is not None:
+            return
+        for server_url in backends:
+            self.refresh(server_url, force=True)
+        self._refresher = threading.Thread(target=self._run, args=(backends,), daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+schema_cache = SchemaCache()
\ No newline at end of file